@@ -0,0 +1,96 @@
+# Rules work for the graphical client, done off the render thread.
+# The client hands jobs to an Analyst, which works through them in order on one background
+# thread, as engine.Search and network.Connection do. Each job gets a board of its own, copied
+# when the job is submitted, so the render thread can go on changing its board meanwhile.
+#
+# Jobs are tagged with the generation of the position they were asked about. When the
+# position changes, the client calls newPosition(). Jobs still queued for an older position
+# are then dropped without being run, a job already running is told to stop early, and
+# results for an older position are thrown away, so a slow answer never turns up after the
+# position it was about has gone and never holds up the jobs after it. A job that fails is
+# logged and dropped.
+#
+# Results are collected with results(), which never blocks. The client sends each one on as
+# a messenger event named after its job (see EVENT). Nothing here imports Panda3D.
+
+import threading
+import Queue
+
+from chesscore import Board, opponent, pieceCode, pieceFromCode
+from bitboard import FULL, indices
+from zobrist import TranspositionTable
+from engine import Search
+from metrics import log
+
+#the messenger event each result is sent as, with the result as its argument
+EVENT = 'analysis-%s'
+
+#seconds an engine suggestion may think for
+SUGGESTION_BUDGET = 1.0
+
+# A copy of a board for a job, keeping only the pieces on the squares in "visible"
+def snapshot(board, visible=FULL):
+	copy = Board()
+	for i in indices(board.occupiedAll() & visible):
+		p = board.pieces[i]
+		copy[p.square] = pieceFromCode(pieceCode(p), p.square)
+	copy.turn = board.turn
+	return copy
+
+#### JOBS ####
+# Each is given the job's own board, then a function that says whether the job has been
+# cancelled, then whatever it was submitted with
+
+# The pieces of side "color" that the other side's pieces on the board attack
+def threats(board, cancelled, color):
+	return board.attackMask(opponent[color], board.occupiedAll()) & board.occupied[color]
+
+# The move engine.py would play
+def suggestion(board, cancelled, budget=SUGGESTION_BUDGET):
+	return Search([board], board.legalMoves(), TranspositionTable(12), budget, 6, 0, cancelled).wait()
+
+JOBS = {'threats': threats, 'suggestion': suggestion}
+
+class Analyst:
+	def __init__(self):
+		self.generation = 0
+		self.jobs = Queue.Queue()
+		self.done = Queue.Queue()
+
+		thread = threading.Thread(target=self.run, name='analysis')
+		thread.daemon = True
+		thread.start()
+
+	# Queues one of JOBS, to be run on a board the caller won't touch again (see snapshot);
+	# never blocks
+	def submit(self, kind, board, *args):
+		self.jobs.put((self.generation, kind, board, args))
+
+	# Call whenever the position changes, to cancel everything asked about the old one
+	def newPosition(self):
+		self.generation += 1
+
+	def run(self):
+		while True:
+			generation, kind, board, args = self.jobs.get()
+			cancelled = lambda: generation != self.generation
+			if cancelled():
+				continue
+			try:
+				result = JOBS[kind](board, cancelled, *args)
+			except Exception:
+				log.exception("Analysis job '%s' failed", kind)
+				continue
+			self.done.put((generation, kind, result))
+
+	# (kind, result) for each job about the current position finished since the last call,
+	# oldest first; never blocks
+	def results(self):
+		results = []
+		try:
+			while True:
+				generation, kind, result = self.done.get_nowait()
+				if generation == self.generation:
+					results.append((kind, result))
+		except Queue.Empty:
+			return results
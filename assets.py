@@ -0,0 +1,58 @@
+# Models and sounds for the graphical client, each loaded from disk once and then shared.
+# Everything the game uses is listed here. preload() works through the list one asset a frame
+# while the menu is up, so by the time a game starts nothing is left to load, and playing a
+# sound when a move arrives never waits on the disk. Anything asked for before its turn in the
+# preload is simply loaded there and then.
+
+from panda3d.core import NodePath
+from direct.task.Task import Task
+
+#every model used by a piece or the board
+MODELS = ["models/square", "models/pawn", "models/knight", "models/bishop", "models/rook", "models/queen", "models/king"]
+SOUNDS = ["audio/ding.wav"]
+
+class Assets:
+	def __init__(self, instanced):
+		#whether nodes share their geometry (see node) or get copies of it
+		self.instanced = instanced
+		self.models = {}
+		self.sounds = {}
+		#copies are made under here, out of the scene, for the caller to reparent
+		self.root = NodePath("assets")
+		self.queue = None
+
+	# Starts loading everything in the background of the next few frames
+	def preload(self):
+		self.queue = [(self.template, path) for path in MODELS] + [(self.sound, path) for path in SOUNDS]
+		taskMgr.add(self.tskPreload, "Preload assets")
+
+	def tskPreload(self, task):
+		if not self.queue:
+			return Task.done
+		load, path = self.queue.pop(0)
+		load(path)
+		return Task.cont
+
+	# The one loaded copy of a model. Don't change it; take a node() instead.
+	def template(self, path):
+		if path not in self.models:
+			self.models[path] = loader.loadModel(path)
+		return self.models[path]
+
+	# A node of its own for a model, to position and color. When instancing, every node of a
+	# model shares the same geometry; otherwise each gets a copy, but still without going back
+	# to the disk.
+	def node(self, path):
+		if not self.instanced:
+			return self.template(path).copyTo(self.root)
+		node = NodePath(path)
+		self.template(path).instanceTo(node)
+		return node
+
+	def sound(self, path):
+		if path not in self.sounds:
+			self.sounds[path] = loader.loadSfx(path)
+		return self.sounds[path]
+
+	def play(self, path):
+		self.sound(path).play()
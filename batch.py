@@ -0,0 +1,128 @@
+# Visibility and attack masks for many positions at once, with NumPy.
+# Positions come in as an N x 64 array of piece codes (see chesscore.pieceCode), indexed by
+# square like Board.pieces. Each side's pieces become one uint64 bitboard per position. From
+# there everything is whole-array operations: leapers and pawns go through the same tables as
+# bitboard.py, and sliders flood along their rays with shifts. The results match
+# Board.visibleMask and Board.attackMask exactly.
+#
+# NumPy is only needed by this module; nothing else in the game imports it.
+
+import numpy
+
+from bitboard import FULL, A_FILE, H_FILE, KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, PAWN_SCOUT
+from chesscore import WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, pieceCode
+
+EMPTY = 0
+
+#positions are worked on this many at a time, to keep the N x 64 temporaries small
+BLOCK = 1 << 14
+
+_U = numpy.uint64
+_ZERO = _U(0)
+_SHIFTS = numpy.arange(64, dtype=_U)
+_BITS = numpy.left_shift(_U(1), _SHIFTS)
+
+_KNIGHT = numpy.array(KNIGHT_ATTACKS, dtype=_U)
+_KING = numpy.array(KING_ATTACKS, dtype=_U)
+_PAWN = [numpy.array(PAWN_ATTACKS[color], dtype=_U) for color in (WHITE, BLACK)]
+_SCOUT = [numpy.array(PAWN_SCOUT[color], dtype=_U) for color in (WHITE, BLACK)]
+
+_NOT_A = _U(FULL & ~A_FILE)
+_NOT_H = _U(FULL & ~H_FILE)
+
+# One step in each direction, dropping whatever falls off the board. Shifting across a file
+# edge would wrap onto the far side of the board, so those moves mask off the file they land on.
+def _north(b): return b << _U(8)
+def _south(b): return b >> _U(8)
+def _east(b): return (b << _U(1)) & _NOT_A
+def _west(b): return (b >> _U(1)) & _NOT_H
+def _northEast(b): return (b << _U(9)) & _NOT_A
+def _northWest(b): return (b << _U(7)) & _NOT_H
+def _southEast(b): return (b >> _U(7)) & _NOT_A
+def _southWest(b): return (b >> _U(9)) & _NOT_H
+
+ORTHOGONAL = [_north, _south, _east, _west]
+DIAGONAL = [_northEast, _northWest, _southEast, _southWest]
+
+#### ENCODING ####
+
+def encode(board):
+	return numpy.array([pieceCode(p) for p in board.pieces], dtype=numpy.uint8)
+
+def encodeBoards(boards):
+	return numpy.array([[pieceCode(p) for p in board.pieces] for board in boards], dtype=numpy.uint8).reshape(-1, 64)
+
+#### MASKS ####
+
+# Bitboards of the squares where an N x 64 boolean array is true
+def _mask(squares):
+	return numpy.bitwise_or.reduce(numpy.where(squares, _BITS, _ZERO), axis=1)
+
+# The union of table[square] over the squares where an N x 64 boolean array is true
+def _gather(squares, table):
+	return numpy.bitwise_or.reduce(numpy.where(squares, table, _ZERO), axis=1)
+
+# Every square reached by sliding from the pieces in one direction, up to and including the
+# first occupied square
+def _slide(pieces, empty, step):
+	ray = step(pieces)
+	attacks = ray
+	for i in xrange(6):
+		ray = step(ray & empty)
+		attacks |= ray
+	return attacks
+
+# What the knights, bishops, rooks, queens and king of one side attack
+def _pieceAttacks(codes, color, empty):
+	base = 1 + 6 * color
+	attacks = _gather(codes == base + KNIGHT, _KNIGHT) | _gather(codes == base + KING, _KING)
+	queens = codes == base + QUEEN
+	rooks = _mask((codes == base + ROOK) | queens)
+	bishops = _mask((codes == base + BISHOP) | queens)
+	for step in ORTHOGONAL:
+		attacks |= _slide(rooks, empty, step)
+	for step in DIAGONAL:
+		attacks |= _slide(bishops, empty, step)
+	return attacks
+
+def _attackBlock(codes, color):
+	empty = _mask(codes == EMPTY)
+	pawns = _gather(codes == 1 + 6 * color + PAWN, _PAWN[color])
+	return pawns | _pieceAttacks(codes, color, empty)
+
+# A piece sees every square it can move to, and its own. For everything but pawns, that is
+# what it attacks, less its own side's squares, which are seen anyway. A pawn can only move
+# into its scouting squares (the three in front and the one two ahead), and it sees all of
+# those regardless.
+def _visibleBlock(codes, color):
+	base = 1 + 6 * color
+	empty = _mask(codes == EMPTY)
+	own = _mask((codes >= base) & (codes < base + 6))
+	return own | _gather(codes == base + PAWN, _SCOUT[color]) | _pieceAttacks(codes, color, empty)
+
+def _blocks(function, codes, color):
+	codes = numpy.asarray(codes, dtype=numpy.uint8).reshape(-1, 64)
+	result = numpy.empty(len(codes), dtype=_U)
+	for start in xrange(0, len(codes), BLOCK):
+		result[start:start+BLOCK] = function(codes[start:start+BLOCK], color)
+	return result
+
+# The squares side "color" can see in each position, as one uint64 bitboard per position
+def visibleMasks(codes, color):
+	return _blocks(_visibleBlock, codes, color)
+
+# The squares side "color" attacks in each position, including ones holding its own pieces,
+# as one uint64 bitboard per position
+def attackMasks(codes, color):
+	return _blocks(_attackBlock, codes, color)
+
+# Unpacks bitboards into an N x 64 boolean array, indexed by square
+def toSquares(masks):
+	masks = numpy.asarray(masks, dtype=_U)
+	return ((masks[:, None] >> _SHIFTS) & _U(1)).astype(bool)
+
+def visibility(codes, color):
+	return toSquares(visibleMasks(codes, color))
+
+def attacked(codes, color):
+	return toSquares(attackMasks(codes, color))
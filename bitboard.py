@@ -0,0 +1,150 @@
+# 64-bit bitboards for move generation.
+# Square (x, y) is bit x + 8*y, so bit 0 is white's queen-side rook corner and bit 63 is
+# black's king-side rook corner. Leapers use precomputed attack tables; sliders use
+# kindergarten bitboards, which turn the occupancy of a line into a 6-bit table index with
+# a single multiply.
+
+FULL = 0xFFFFFFFFFFFFFFFF
+A_FILE = 0x0101010101010101
+B_FILE = 0x0202020202020202
+H_FILE = 0x8080808080808080
+RANK_1 = 0xFF
+#the c2-h7 diagonal; multiplying by it gathers the a-file onto the eighth rank
+C2_H7 = 0x0004081020408000
+
+def index((x,y)):
+	return x + 8*y
+
+def square(i):
+	return (i & 7, i >> 3)
+
+def bit(sq):
+	return 1 << (sq[0] + 8*sq[1])
+
+def popcount(mask):
+	return bin(mask).count('1')
+
+# Iterates over the indices of the set bits of a mask, lowest first
+def indices(mask):
+	while mask:
+		low = mask & -mask
+		yield low.bit_length() - 1
+		mask ^= low
+
+# A set of squares stored as a bitboard. Behaves like a set of (x, y) tuples for membership
+# and iteration, so callers only pay for the conversion when they actually need squares.
+class SquareSet(long):
+	def __contains__(self, (x,y)):
+		return 0 <= x < 8 and 0 <= y < 8 and bool(self >> (x + 8*y) & 1)
+
+	def __iter__(self):
+		for i in indices(self):
+			yield (i & 7, i >> 3)
+
+	def __len__(self):
+		return popcount(self)
+
+	def __repr__(self):
+		return 'SquareSet(%s)' % sorted(self)
+
+#### TABLES ####
+
+def _leaperTable(offsets):
+	table = []
+	for i in xrange(64):
+		x, y = square(i)
+		mask = 0
+		for (dx, dy) in offsets:
+			if 0 <= x+dx < 8 and 0 <= y+dy < 8:
+				mask |= bit((x+dx, y+dy))
+		table.append(mask)
+	return table
+
+KNIGHT_ATTACKS = _leaperTable([(1,2), (2,1), (2,-1), (1,-2), (-1,-2), (-2,-1), (-2,1), (-1,2)])
+KING_ATTACKS = _leaperTable([(1,0), (1,1), (0,1), (-1,1), (-1,0), (-1,-1), (0,-1), (1,-1)])
+#squares a pawn captures on, indexed by side (0 is white, moving up the board) and square
+PAWN_ATTACKS = [_leaperTable([(1,1), (-1,1)]), _leaperTable([(1,-1), (-1,-1)])]
+#squares a pawn can always see: the three in front of it, and the one two squares ahead
+PAWN_SCOUT = [_leaperTable([(-1,1), (0,1), (1,1), (0,2)]), _leaperTable([(-1,-1), (0,-1), (1,-1), (0,-2)])]
+
+def _lineMask(i, dx, dy):
+	x, y = square(i)
+	mask = 0
+	for d in (1, -1):
+		j = 1
+		while 0 <= x + d*dx*j < 8 and 0 <= y + d*dy*j < 8:
+			mask |= bit((x + d*dx*j, y + d*dy*j))
+			j += 1
+	return mask
+
+#BETWEEN[a][b]: the squares strictly between two squares on a line, or 0 if they aren't on one
+BETWEEN = [[0] * 64 for i in xrange(64)]
+for _i in xrange(64):
+	for (_dx, _dy) in [(1,0), (1,1), (0,1), (-1,1), (-1,0), (-1,-1), (0,-1), (1,-1)]:
+		_x, _y = square(_i)
+		_between = 0
+		while 0 <= _x+_dx < 8 and 0 <= _y+_dy < 8:
+			_x, _y = _x+_dx, _y+_dy
+			BETWEEN[_i][index((_x, _y))] = _between
+			_between |= bit((_x, _y))
+del _i, _dx, _dy, _x, _y, _between
+
+RANK_MASK = [_lineMask(i, 1, 0) for i in xrange(64)]
+DIAGONAL_MASK = [_lineMask(i, 1, 1) for i in xrange(64)]
+ANTIDIAGONAL_MASK = [_lineMask(i, 1, -1) for i in xrange(64)]
+
+# Attacks along a single line of 8 squares, walked the slow way. Only used to fill the tables.
+def _lineAttacks(pos, occ):
+	attacks = 0
+	for d in (1, -1):
+		j = pos + d
+		while 0 <= j < 8:
+			attacks |= 1 << j
+			if occ >> j & 1:
+				break
+			j += d
+	return attacks
+
+#FILL_UP[file][occ6]: the attacks of a slider on that file of a rank, copied onto every rank
+FILL_UP = [[_lineAttacks(f, occ6 << 1) * A_FILE for occ6 in xrange(64)] for f in xrange(8)]
+
+#A_FILE_ATTACKS[rank][idx]: the attacks of a slider on that rank of the a-file, indexed the
+#same way fileAttacks indexes them
+A_FILE_ATTACKS = [[0] * 64 for r in xrange(8)]
+for _r in xrange(8):
+	for _occ6 in xrange(64):
+		_occ = sum(1 << (8*j) for j in xrange(1, 7) if _occ6 >> (j-1) & 1)
+		_attacks = _lineAttacks(_r, _occ6 << 1)
+		A_FILE_ATTACKS[_r][((_occ * C2_H7) & FULL) >> 58] = sum(1 << (8*j) for j in xrange(8) if _attacks >> j & 1)
+del _r, _occ6, _occ, _attacks
+
+#### SLIDING ATTACKS ####
+
+def _kindergarten(i, occ, mask):
+	return FILL_UP[i & 7][((occ & mask) * B_FILE & FULL) >> 58] & mask
+
+def rankAttacks(i, occ):
+	return _kindergarten(i, occ, RANK_MASK[i])
+
+def fileAttacks(i, occ):
+	f = i & 7
+	return A_FILE_ATTACKS[i >> 3][(((occ >> f) & A_FILE) * C2_H7 & FULL) >> 58] << f
+
+def diagonalAttacks(i, occ):
+	return _kindergarten(i, occ, DIAGONAL_MASK[i]) | _kindergarten(i, occ, ANTIDIAGONAL_MASK[i])
+
+def rookAttacks(i, occ):
+	return rankAttacks(i, occ) | fileAttacks(i, occ)
+
+def bishopAttacks(i, occ):
+	return diagonalAttacks(i, occ)
+
+def queenAttacks(i, occ):
+	return rookAttacks(i, occ) | diagonalAttacks(i, occ)
+
+# The squares attacked by all of a side's pawns at once
+def pawnAttacks(pawns, color):
+	if color == 0:
+		return ((pawns & ~H_FILE) << 9 | (pawns & ~A_FILE) << 7) & FULL
+	else:
+		return (pawns & ~A_FILE) >> 9 | (pawns & ~H_FILE) >> 7
@@ -0,0 +1,167 @@
+# Live games for spectators.
+# A spectator watches one game through one of three views: the whole board, or what white or
+# black can see. Each view of a game keeps a single log of FOG messages (see protocol.py),
+# encoded and framed once per move however many spectators are watching through it. Nothing
+# is pushed to spectators. Each one keeps its place in its view's log and copies bytes out of
+# it whenever its socket can take more. Publishing a move therefore costs the same with one
+# spectator as with thousands, and never waits on any of them.
+#
+# The log only keeps the last BACKLOG messages, and a spectator only takes more once it has
+# less than WINDOW bytes waiting to go out. A spectator that falls further behind than the log
+# goes back skips straight to the present. It is sent its view's whole board in one message,
+# and that replaces everything it missed, since a FOG message gives each square's contents
+# outright.
+#
+# Anyone can open a spectator connection, including a player in the game. In a game whose
+# players may only see what they can see (server.py --authoritative), spectators are therefore
+# shown nothing but the opening position until the game is over, and then the whole game.
+
+import asyncore
+import socket
+import itertools
+import collections
+
+import protocol
+import gamerecord
+from chesscore import Board, WHITE, BLACK
+from visibility import View
+
+#messages kept for spectators who are behind
+BACKLOG = 64
+#bytes a spectator may have waiting to be sent before it stops taking messages
+WINDOW = 4096
+
+# One view of one game, and the messages it has sent
+class Channel:
+	def __init__(self, view, board):
+		self.view = View(None if view == protocol.EVERYTHING else view)
+		self.log = collections.deque(maxlen=BACKLOG)
+		#sequence number of the next message; the log holds the ones just before it
+		self.next = 0
+		self.whole = None
+		self.ended = False
+		self.publish(board, gamerecord.statusFlags(board))
+
+	def publish(self, board, flags):
+		self.turn, self.flags = board.turn, flags
+		self.log.append(protocol.frame(protocol.encodeFog(board.turn, flags, self.view.update(board))))
+		self.next += 1
+		self.whole = None
+
+	# The framed messages after sequence number "position", and the position to ask from next time
+	def take(self, position):
+		first = self.next - len(self.log)
+		if position < first:
+			if self.whole is None:
+				self.whole = protocol.frame(protocol.encodeFog(self.turn, self.flags, self.view.snapshot()))
+			return self.whole, self.next
+		return ''.join(itertools.islice(self.log, position - first, None)), self.next
+
+# The channels of one game, made as spectators ask for them. A game that isn't live is kept
+# from spectators until it ends: they watch a board of our own, which only replays the game's
+# moves then.
+class Broadcast:
+	def __init__(self, board, live=True):
+		if live:
+			self.board = board
+		else:
+			self.board = Board()
+			self.board.setup()
+		self.live = live
+		#moves made in the game and not yet shown to spectators
+		self.moves = collections.deque()
+		self.channels = {}
+
+	def subscribe(self, spectator, view):
+		if view not in (WHITE, BLACK, protocol.EVERYTHING):
+			spectator.close()
+			return
+		if view not in self.channels:
+			self.channels[view] = Channel(view, self.board)
+		spectator.watch(self.channels[view])
+
+	# Call after every move, once the players have been told
+	def publish(self, fr, to):
+		if not self.live:
+			self.moves.append((fr, to))
+			return
+		self.send()
+
+	def send(self):
+		if not self.channels:
+			return
+		flags = gamerecord.statusFlags(self.board)
+		for channel in self.channels.itervalues():
+			channel.publish(self.board, flags)
+
+	# Spectators are let go once they have seen the end of the game
+	def end(self):
+		while self.moves:
+			self.board.makeMove(*self.moves.popleft())
+			self.send()
+		for channel in self.channels.itervalues():
+			channel.ended = True
+
+class SpectatorConnection(asyncore.dispatcher):
+	def __init__(self, server, sock, addr):
+		asyncore.dispatcher.__init__(self, sock)
+		self.server = server
+		self.addr = addr
+		self.frames = protocol.FrameReader()
+		self.outgoing = ''
+		self.channel = None
+		#a new spectator is behind everything, so the first thing it gets is the whole board
+		self.position = -1
+
+	def watch(self, channel):
+		self.channel = channel
+
+	def caughtUp(self):
+		return not self.channel or self.position == self.channel.next
+
+	def writable(self):
+		return bool(self.outgoing) or not self.caughtUp() or bool(self.channel and self.channel.ended)
+
+	def handle_write(self):
+		if not self.caughtUp() and len(self.outgoing) < WINDOW:
+			data, self.position = self.channel.take(self.position)
+			self.outgoing += data
+		if not self.outgoing:
+			if self.channel.ended:
+				self.close()
+			return
+		sent = self.send(self.outgoing)
+		self.outgoing = self.outgoing[sent:]
+
+	def handle_read(self):
+		for payload in self.frames.feed(self.recv(4096)):
+			if protocol.messageType(payload) == protocol.SUBSCRIBE and not self.channel:
+				self.server.subscribe(self, *protocol.decodeSubscribe(payload))
+
+	def handle_close(self):
+		self.close()
+
+# Accepts spectators for the games of a GameServer (see server.py)
+class SpectatorServer(asyncore.dispatcher):
+	def __init__(self, games, port=protocol.SPECTATOR_PORT, backlog=1000):
+		asyncore.dispatcher.__init__(self)
+		self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.set_reuse_addr()
+		self.bind(('', port))
+		self.listen(backlog)
+		#game id -> server.Game, shared with the GameServer
+		self.games = games
+
+	def handle_accept(self):
+		pair = self.accept()
+		if pair is None:
+			return
+		sock, addr = pair
+		SpectatorConnection(self, sock, addr)
+
+	def subscribe(self, spectator, gameId, view):
+		game = self.games.get(gameId)
+		if game is None:
+			spectator.close()
+			return
+		game.broadcast.subscribe(spectator, view)
@@ -0,0 +1,441 @@
+# The rules of Fog of War Chess, with no dependency on Panda3D.
+# Nothing in here knows about models, render colors or the scene graph, so the graphical
+# client, servers, AIs and test scripts can all share the same rules.
+
+from bitboard import FULL, SquareSet, index, bit, indices, BETWEEN
+from bitboard import KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, PAWN_SCOUT
+from bitboard import rookAttacks, bishopAttacks, queenAttacks, pawnAttacks
+import zobrist
+from zobrist import TranspositionTable
+
+#sides
+WHITE = 0
+BLACK = 1
+
+#flips black <-> white
+opponent = {WHITE: BLACK, BLACK: WHITE}
+
+#kinds of piece, used to index the per-kind bitboards
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+
+#move tables and visibility of recent positions, shared by every board so a position reached
+#twice, in one game or in many, is only worked out once. Check tests are cheaper to redo than
+#to look up, so they aren't kept.
+CACHE = TranspositionTable(14)
+
+def onBoard((x,y)):
+	return 0 <= x < 8 and 0 <= y < 8
+
+# fractions.gcd, without the import of fractions, which costs more than the rest of this module
+def gcd(a, b):
+	while b:
+		a, b = b, a % b
+	return a
+
+class Board:
+	def __init__(self):
+		#The piece on each square, indexed by x + 8*y. It never grows: looking up a square off
+		#the board just finds nothing there.
+		self.pieces = [None] * 64
+		self.turn = WHITE
+		#bitboards of the squares occupied by each side, and by each kind of piece of each side,
+		#kept in step with self.pieces
+		self.occupied = [0, 0]
+		self.bitboards = [[0] * 6, [0] * 6]
+		self.kings = [None, None]
+		#squares attacked by each side in the current position; see attacks
+		self.attackMaps = [None, None]
+		#moves for the current position; see moveTable
+		self.table = None
+		#what unmakeMove needs to take back each move made so far
+		self.history = []
+		#Zobrist key of the pieces on the board, kept in step with self.pieces; see positionKey
+		self.key = 0
+		#positionKey before each move made so far
+		self.keys = []
+		self.cache = CACHE
+
+	def __getitem__(self, (x,y)):
+		if 0 <= x < 8 and 0 <= y < 8:
+			return self.pieces[x + 8*y]
+		return None
+
+	def __setitem__(self, sq, piece):
+		if not onBoard(sq):
+			raise IndexError("%s is not on the board" % (sq,))
+		old = self.pieces[index(sq)]
+		if old:
+			self.occupied[old.color] &= ~bit(sq)
+			self.bitboards[old.color][old.kind] &= ~bit(sq)
+			self.key ^= zobrist.PIECES[old.color][old.kind][index(sq)]
+		if piece:
+			self.occupied[piece.color] |= bit(sq)
+			self.bitboards[piece.color][piece.kind] |= bit(sq)
+			self.key ^= zobrist.PIECES[piece.color][piece.kind][index(sq)]
+			if piece.kind == KING:
+				self.kings[piece.color] = sq
+		self.pieces[index(sq)] = piece
+		self.attackMaps[WHITE] = self.attackMaps[BLACK] = None
+
+	def occupiedAll(self):
+		return self.occupied[WHITE] | self.occupied[BLACK]
+
+	# Places the pieces for the start of a game
+	def setup(self):
+		#The order of pieces on a chessboard from white's perspective
+		pieceOrder = [Rook, Knight, Bishop, Queen, King, Bishop, Knight, Rook]
+
+		for i in xrange(8):
+			self[i, 1] = Pawn((i, 1), WHITE)
+			self[i, 6] = Pawn((i, 6), BLACK)
+			self[i, 0] = pieceOrder[i]((i, 0), WHITE)
+			self[i, 7] = pieceOrder[i]((i, 7), BLACK)
+		self.turn = WHITE
+		self.table = None
+		self.history = []
+		self.keys = []
+
+	# Sets up a position from the board and side-to-move fields of a FEN string. There is no
+	# castling, en passant or promotion in this game, so any other fields are ignored.
+	# Pawns off their starting rank are taken to have moved.
+	def setupFEN(self, fen):
+		fields = fen.split()
+		for y, row in enumerate(reversed(fields[0].split('/'))):
+			x = 0
+			for c in row:
+				if c.isdigit():
+					x += int(c)
+					continue
+				color = WHITE if c.isupper() else BLACK
+				self[x, y] = pieceFromCode(1 + FEN_LETTERS.index(c.lower()) + 6 * color, (x, y))
+				x += 1
+		self.turn = BLACK if len(fields) > 1 and fields[1] == 'b' else WHITE
+		self.table = None
+		self.history = []
+		self.keys = []
+
+	def fen(self):
+		rows = []
+		for y in reversed(xrange(8)):
+			row = ''
+			empty = 0
+			for x in xrange(8):
+				p = self[x, y]
+				if not p:
+					empty += 1
+					continue
+				if empty:
+					row += str(empty)
+					empty = 0
+				c = FEN_LETTERS[p.kind]
+				row += c.upper() if p.color == WHITE else c
+			if empty:
+				row += str(empty)
+			rows.append(row)
+		return '/'.join(rows) + (' w' if self.turn == WHITE else ' b')
+
+	# All of the pieces on the board, optionally only those of one side
+	def pieceList(self, color=None):
+		return [p for p in self.pieces if p and (color is None or p.color == color)]
+
+	def kingSquare(self, color):
+		return self.kings[color]
+
+	# Identifies the position: the same pieces on the same squares with the same side to move
+	# always give the same key
+	def positionKey(self):
+		return self.key ^ zobrist.SIDE[self.turn]
+
+	# How many times the current position has come up before in this game
+	def repetitions(self):
+		return self.keys.count(self.positionKey())
+
+	#### ATTACKS ####
+
+	# Bitboard of the pieces of side "color" that attack square i, given the occupancy occ
+	def attackersTo(self, i, color, occ=None):
+		if occ is None: occ = self.occupiedAll()
+		bb = self.bitboards[color]
+		return (KNIGHT_ATTACKS[i] & bb[KNIGHT]
+			| KING_ATTACKS[i] & bb[KING]
+			| PAWN_ATTACKS[opponent[color]][i] & bb[PAWN]
+			| rookAttacks(i, occ) & (bb[ROOK] | bb[QUEEN])
+			| bishopAttacks(i, occ) & (bb[BISHOP] | bb[QUEEN]))
+
+	# Bitboard of every square side "color" attacks, including squares holding its own pieces
+	def attackMask(self, color, occ):
+		bb = self.bitboards[color]
+		attacks = pawnAttacks(bb[PAWN], color)
+		for i in indices(bb[KNIGHT]):
+			attacks |= KNIGHT_ATTACKS[i]
+		for i in indices(bb[BISHOP] | bb[QUEEN]):
+			attacks |= bishopAttacks(i, occ)
+		for i in indices(bb[ROOK] | bb[QUEEN]):
+			attacks |= rookAttacks(i, occ)
+		for i in indices(bb[KING]):
+			attacks |= KING_ATTACKS[i]
+		return attacks
+
+	# The attack map of side "color" for the current position, computed at most once
+	def attacks(self, color):
+		if self.attackMaps[color] is None:
+			self.attackMaps[color] = self.attackMask(color, self.occupiedAll())
+		return self.attackMaps[color]
+
+	# Bitboard of the enemy pieces giving check to the king of side "color"
+	def checkers(self, color):
+		return self.attackersTo(index(self.kings[color]), opponent[color])
+
+	# Finds the pieces of side "color" that are pinned to their king.
+	# Returns a dictionary mapping each pinned square's index to the bitboard of squares it may
+	# still move to: the line between the king and the pinner, including the pinner.
+	def pins(self, color):
+		k = index(self.kings[color])
+		occ = self.occupiedAll()
+		enemy = self.bitboards[opponent[color]]
+		snipers = (rookAttacks(k, 0) & (enemy[ROOK] | enemy[QUEEN])
+			| bishopAttacks(k, 0) & (enemy[BISHOP] | enemy[QUEEN]))
+		pins = {}
+		for s in indices(snipers):
+			between = BETWEEN[k][s] & occ
+			if between and not between & (between - 1) and between & self.occupied[color]:
+				pins[between.bit_length() - 1] = BETWEEN[k][s] | 1 << s
+		return pins
+
+	# Determines whether the player specified by "color" is in check
+	def inCheck(self, color):
+		return bool(self.checkers(color))
+
+	#### MOVES ####
+
+	# Maps the square of each piece of the side to move to a pair of SquareSets: the squares
+	# it could move to without considering check, and the ones that are actually legal.
+	# Computed once per position, and looked up in the cache when the position has been seen
+	# before; makeMove throws it away.
+	def moveTable(self):
+		if self.table is None:
+			self.table = self.cache.get(self.positionKey() ^ zobrist.MOVES)
+		if self.table is None:
+			us = self.turn
+			k = index(self.kings[us])
+			checkers = self.checkers(us)
+			pins = self.pins(us)
+			#where the king may not go: anywhere attacked once the king is out of the way
+			danger = self.attackMask(opponent[us], self.occupiedAll() & ~(1 << k))
+			#where everything else must go to deal with a check
+			if not checkers:
+				evasions = FULL
+			elif checkers & (checkers - 1):
+				evasions = 0
+			else:
+				evasions = checkers | BETWEEN[k][checkers.bit_length() - 1]
+
+			table = {}
+			for p in self.pieceList(us):
+				valid = p.moveMask(self)
+				if p.kind == KING:
+					legal = valid & ~danger
+				else:
+					legal = valid & evasions & pins.get(index(p.square), FULL)
+				table[p.square] = (SquareSet(valid), SquareSet(legal))
+			self.table = table
+			self.cache.put(self.positionKey() ^ zobrist.MOVES, table)
+		return self.table
+
+	# Whether the piece on fr could move to "to", without considering check
+	def isValidMove(self, fr, to):
+		if self[fr] and self[fr].color == self.turn:
+			return to in self.moveTable()[fr][0]
+		return bool(self[fr]) and self[fr].isValidMove(to, self)
+
+	def isLegalMove(self, fr, to):
+		entry = self.moveTable().get(fr)
+		return bool(entry) and to in entry[1]
+
+	# Tries out a move and reports whether it would leave the mover's king in check
+	def leavesKingInCheck(self, fr, to):
+		color = self[fr].color
+		self.makeMove(fr, to)
+		check = self.inCheck(color)
+		self.unmakeMove()
+		return check
+
+	# Every legal move for the side to move, as (from, to) pairs
+	def legalMoves(self):
+		return [(fr, to) for (fr, (valid, legal)) in self.moveTable().items() for to in legal]
+
+	def hasLegalMoves(self):
+		for (valid, legal) in self.moveTable().itervalues():
+			if legal:
+				return True
+		return False
+
+	def isCheckmate(self):
+		return not self.hasLegalMoves() and self.inCheck(self.turn)
+
+	def isStalemate(self):
+		return not self.hasLegalMoves() and not self.inCheck(self.turn)
+
+	# Updates the board for a move. Does not check that the move is legal.
+	# Returns the captured piece, if any.
+	def makeMove(self, fr, to):
+		frP = self[fr]
+		toP = self[to]
+
+		self.history.append((fr, to, toP, frP.haveMoved, self.table))
+		self.keys.append(self.positionKey())
+		frP.move(to)
+		self[fr] = None
+		self[to] = frP
+		self.turn = opponent[self.turn]
+		self.table = None
+		return toP
+
+	# Takes back the last move made with makeMove, restoring the board exactly
+	def unmakeMove(self):
+		fr, to, toP, haveMoved, table = self.history.pop()
+		self.keys.pop()
+		frP = self[to]
+
+		self[fr] = frP
+		self[to] = toP
+		frP.square = fr
+		frP.haveMoved = haveMoved
+		self.turn = opponent[self.turn]
+		self.table = table
+
+	#### VISIBILITY ####
+
+	# All of the squares that the player specified by "color" can see, as a bitboard
+	def visibleMask(self, color):
+		key = self.key ^ zobrist.VISION[color]
+		visibles = self.cache.get(key)
+		if visibles is None:
+			visibles = 0
+			for p in self.pieceList(color):
+				visibles |= p.visibleMask(self)
+			self.cache.put(key, visibles)
+		return visibles
+
+	def visibleSquares(self, color):
+		return SquareSet(self.visibleMask(color))
+
+# Pieces only hold the state the rules need, in slots rather than a dictionary each
+class Piece(object):
+	__slots__ = ('square', 'color', 'dir', 'haveMoved')
+
+	def __init__(self, square, color):
+		self.haveMoved = False
+		self.square = square
+		self.color = color
+		self.dir = 1 if color == WHITE else -1
+
+	def isValidMove(self, dest, board):
+		return dest in self.validMoves(board)
+
+	def isValidCapture(self, dest, board):
+		return self.isValidMove(dest, board)
+
+	# The squares this piece can move to, as a bitboard
+	def moveMask(self, board):
+		return FULL & ~board.occupied[self.color]
+
+	def validMoves(self, board):
+		return SquareSet(self.moveMask(board))
+
+	def visibleMask(self, board):
+		return self.moveMask(board) | bit(self.square)
+
+	def visibleSquares(self, board):
+		return SquareSet(self.visibleMask(board))
+
+	def move(self, dest):
+		self.square = dest
+		self.haveMoved = True
+
+	def path(self, dest):
+		startX, startY = self.square
+		destX, destY = dest
+
+		steps = gcd(abs(destX - startX), abs(destY - startY))
+		dx = (destX - startX)/steps
+		dy = (destY - startY)/steps
+		return [(startX + dx*i, startY + dy*i) for i in xrange(steps+1)]
+
+class Pawn(Piece):
+	__slots__ = ()
+	kind = PAWN
+
+	def moveMask(self, board):
+		i = index(self.square)
+		empty = FULL & ~board.occupiedAll()
+		#one step forward, shifting off the board when the pawn is on the last rank
+		if self.dir > 0:
+			ahead = (1 << (i + 8)) & FULL & empty
+		else:
+			ahead = (1 << i >> 8) & empty
+		moves = ahead
+		if ahead and not self.haveMoved:
+			if self.dir > 0:
+				moves |= (ahead << 8) & FULL & empty
+			else:
+				moves |= (ahead >> 8) & empty
+		return moves | PAWN_ATTACKS[self.color][i] & board.occupied[opponent[self.color]]
+
+	def visibleMask(self, board):
+		#pawns have different visibility rules; namely they can *always* see the three that they could conceivably move to. They're awesome scouts!
+		# They can also see two squares ahead no matter what. This could involve seeing around other pieces.
+		return Piece.visibleMask(self, board) | PAWN_SCOUT[self.color][index(self.square)]
+
+class King(Piece):
+	__slots__ = ()
+	kind = KING
+
+	def moveMask(self, board):
+		return KING_ATTACKS[index(self.square)] & ~board.occupied[self.color]
+
+class Queen(Piece):
+	__slots__ = ()
+	kind = QUEEN
+
+	def moveMask(self, board):
+		return queenAttacks(index(self.square), board.occupiedAll()) & ~board.occupied[self.color]
+
+class Bishop(Piece):
+	__slots__ = ()
+	kind = BISHOP
+
+	def moveMask(self, board):
+		return bishopAttacks(index(self.square), board.occupiedAll()) & ~board.occupied[self.color]
+
+class Knight(Piece):
+	__slots__ = ()
+	kind = KNIGHT
+
+	def moveMask(self, board):
+		return KNIGHT_ATTACKS[index(self.square)] & ~board.occupied[self.color]
+
+class Rook(Piece):
+	__slots__ = ()
+	kind = ROOK
+
+	def moveMask(self, board):
+		return rookAttacks(index(self.square), board.occupiedAll()) & ~board.occupied[self.color]
+
+FEN_PIECES = {'p': Pawn, 'n': Knight, 'b': Bishop, 'r': Rook, 'q': Queen, 'k': King}
+FEN_LETTERS = 'pnbrqk'
+
+# A single byte for a piece, or for an empty square: 0 for nothing, 1 + kind for a white
+# piece and 7 + kind for a black one
+def pieceCode(piece):
+	return 1 + piece.kind + 6 * piece.color if piece else 0
+
+# The piece a code stands for, standing on square sq
+def pieceFromCode(code, sq):
+	if not code:
+		return None
+	color, kind = divmod(code - 1, 6)
+	piece = FEN_PIECES[FEN_LETTERS[kind]](sq, color)
+	if kind == PAWN:
+		piece.haveMoved = sq[1] != (1 if color == WHITE else 6)
+	return piece
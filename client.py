@@ -0,0 +1,1082 @@
+# Author: Christian Mann
+# Credits: Shao Zhang, Phil Saltzman for providing the models and chessboard base for grabbing and dropping pieces
+# Last updated: 5/5/2012
+
+# The graphical client. main.py starts it; importing this file loads Panda3D but doesn't open
+# a window until main() is called.
+
+from direct.showbase.ShowBase import ShowBase
+from panda3d.core import AmbientLight,DirectionalLight,LightAttrib,Spotlight,PerspectiveLens
+from panda3d.core import TextNode
+from panda3d.core import *
+from pandac.PandaModules import *
+from direct.gui.OnscreenText import OnscreenText
+from direct.showbase.DirectObject import DirectObject
+from direct.task.Task import Task
+from direct.interval.IntervalGlobal import Sequence,Func,Wait
+from direct.gui.OnscreenText import OnscreenText 
+from direct.gui.DirectGui import *
+
+import random
+import sys
+import math
+import time
+import atexit
+
+import chesscore
+import protocol
+import network
+import engine
+import gamerecord
+import analysis
+import metrics
+from assets import Assets
+from quality import Quality
+from metrics import log
+from chesscore import Board, Pawn, Knight, Bishop, Rook, Queen, King, pieceCode, pieceFromCode
+from bitboard import FULL, SquareSet, bit, square, indices
+from visibility import VisibilityMap
+
+#color constants
+BLACK = (0,0,0,1)
+WHITE = (1,1,1,1)
+HIGHLIGHT = (0,1,1,1)
+PIECEBLACK = (.15, .15, .15, 1)
+PIECEWHITE = WHITE
+
+#the render color of each side's pieces
+PIECECOLOR = {chesscore.WHITE: PIECEWHITE, chesscore.BLACK: PIECEBLACK}
+
+#the model used for each kind of piece (see assets.py)
+MODELS = {Pawn: "models/pawn", Knight: "models/knight", Bishop: "models/bishop", Rook: "models/rook", Queen: "models/queen", King: "models/king"}
+
+SERVER = "Server"
+CLIENT = "Client"
+COMPUTER = "Computer"
+
+#every game played is added to this archive (see gamerecord.py)
+RECORD = 'client.fowr'
+
+#seconds to keep trying to get back into a game after losing the connection
+RECONNECT = 60.0
+
+#where every snapshot of the figures collected by metrics.py is sent as it is taken: a file,
+#or a URL to POST them to. Without one they are only written out when F6 is pressed.
+METRICS = metrics.exportTarget(sys.argv)
+
+#Draw the board as one mesh and share one copy of each piece model, unless asked not to
+INSTANCED = '--classic-render' not in sys.argv
+
+#flips server <-> client
+flip = {SERVER: CLIENT, CLIENT: SERVER}
+
+#intersection of a line and a plane
+def PointAtZ(z, point, vec):
+	return point + vec * ((z - point.getZ()) / vec.getZ())
+
+#position of each chessboard square in space
+def SquarePos((x,y)):
+	return ((x - 3.5, y - 3.5, 0))
+
+# "e4" and so on
+def SquareName((x,y)):
+	return "abcdefgh"[x] + str(y + 1)
+
+#determines whether a square is white or black
+def SquareColor((x,y)):
+	if (x + y)%2: return BLACK
+	else: return WHITE
+
+# The board as 64 separate square models. Every square is its own node and its own draw call.
+class SquareNodes:
+	def __init__(self, root, assets):
+		#For each square
+		self.nodes = dict(((i,j), None) for i in range(8) for j in range(8))
+		for place in self.nodes:
+			#Copy, parent, color, and position the model (a single square polygon)
+			self.nodes[place] = assets.node("models/square")
+			self.nodes[place].reparentTo(root)
+			self.nodes[place].setPos(SquarePos(place))
+			self.nodes[place].setColor(SquareColor(place))
+			self.nodes[place].setTransparency(TransparencyAttrib.MAlpha)
+	
+	def setColor(self, sq, color):
+		self.nodes[sq].setColor(color)
+	
+	def setAlpha(self, sq, alpha):
+		self.nodes[sq].setAlphaScale(alpha)
+	
+	# Called once a frame after any setAlpha calls
+	def flush(self):
+		pass
+	
+	def getPos(self, sq):
+		return self.nodes[sq].getPos()
+
+# The board as a single mesh made of 64 copies of the square model's polygon. Each square's
+# color is stored in its vertex colors, so the whole board is one draw call. The fog is an 8x8
+# texture with one texel per square, modulating the board's alpha; it needs no shaders, so it
+# also works with the software renderer.
+class BoardMesh:
+	def __init__(self, root, assets):
+		#Copy the vertices and triangles of the one square model
+		template = assets.template("models/square").find("**/+GeomNode").node().getGeom(0)
+		templateData = template.getVertexData()
+		vertices = []
+		readers = [GeomVertexReader(templateData, column) for column in ('vertex', 'normal')]
+		for row in xrange(templateData.getNumRows()):
+			vertices.append([r.getData3f() for r in readers])
+		triangles = template.getPrimitive(0).decompose()
+		corners = [triangles.getVertex(i) for i in xrange(triangles.getNumVertices())]
+		self.rows = len(vertices)
+		
+		data = GeomVertexData('board', GeomVertexFormat.getV3n3c4t2(), Geom.UHDynamic)
+		data.setNumRows(64 * self.rows)
+		vertexWriter = GeomVertexWriter(data, 'vertex')
+		normalWriter = GeomVertexWriter(data, 'normal')
+		colorWriter = GeomVertexWriter(data, 'color')
+		texcoordWriter = GeomVertexWriter(data, 'texcoord')
+		prim = GeomTriangles(Geom.UHStatic)
+		
+		#current RGBA of each square
+		self.colors = {}
+		for i in xrange(64):
+			place = (i & 7, i >> 3)
+			self.colors[place] = list(SquareColor(place))
+			for (vertex, normal) in vertices:
+				position = vertex + Point3(*SquarePos(place))
+				vertexWriter.addData3f(position)
+				normalWriter.addData3f(normal)
+				colorWriter.addData4f(*self.colors[place])
+				#the whole board spans the fog texture once
+				texcoordWriter.addData2f((position.getX() + 4) / 8.0, (position.getY() + 4) / 8.0)
+			for corner in corners:
+				prim.addVertex(i * self.rows + corner)
+		
+		geom = Geom(data)
+		geom.addPrimitive(prim)
+		self.geomNode = GeomNode('board')
+		self.geomNode.addGeom(geom)
+		self.node = root.attachNewNode(self.geomNode)
+		self.node.setTransparency(TransparencyAttrib.MAlpha)
+		
+		#white texels whose alpha is the fog; row 0 is the bottom of the texture, like y = 0
+		self.texels = bytearray('\xff' * (64 * 4))
+		self.fogTexture = Texture('fog')
+		self.fogTexture.setup2dTexture(8, 8, Texture.TUnsignedByte, Texture.FRgba)
+		self.fogTexture.setMinfilter(Texture.FTNearest)
+		self.fogTexture.setMagfilter(Texture.FTNearest)
+		self.fogTexture.setWrapU(Texture.WMClamp)
+		self.fogTexture.setWrapV(Texture.WMClamp)
+		self.fogStage = TextureStage('fog')
+		self.fogStage.setMode(TextureStage.MModulate)
+		self.node.setTexture(self.fogStage, self.fogTexture)
+		self.flush()
+	
+	def writeColor(self, (x,y)):
+		writer = GeomVertexWriter(self.geomNode.modifyGeom(0).modifyVertexData(), 'color')
+		writer.setRow((x + 8*y) * self.rows)
+		for row in xrange(self.rows):
+			writer.setData4f(*self.colors[x,y])
+	
+	def setColor(self, sq, color):
+		self.colors[sq][:3] = color[:3]
+		self.writeColor(sq)
+	
+	def setAlpha(self, (x,y), alpha):
+		self.texels[(x + 8*y) * 4 + 3] = int(alpha * 255 + 0.5)
+	
+	# Uploads the fog texture; one upload covers every square that changed this frame
+	def flush(self):
+		self.fogTexture.setRamImageAs(str(self.texels), 'RGBA')
+	
+	def getPos(self, sq):
+		return Point3(*SquarePos(sq))
+	
+# Fades squares, and the pieces on them, in and out of the fog. A single task steps every
+# square that is still fading and hands the new alphas to the board in one go, so a change in
+# visibility costs no intervals at all.
+class FogFader:
+	def __init__(self, squares, setPieceAlpha):
+		self.squares = squares
+		self.setPieceAlpha = setPieceAlpha
+		#current alpha, target alpha and change per second of each square
+		self.alpha = dict(((i,j), 1.0) for i in range(8) for j in range(8))
+		self.target = dict(self.alpha)
+		self.rate = dict.fromkeys(self.alpha, 0.0)
+		self.fading = set()
+		self.task = None
+	
+	def getAlpha(self, sq):
+		return self.alpha[sq]
+	
+	def fadeTo(self, sq, alpha, dt):
+		self.target[sq] = alpha
+		#None means jump straight there on the next frame
+		self.rate[sq] = abs(alpha - self.alpha[sq]) / dt if dt > 0 else None
+		self.fading.add(sq)
+		if not self.task:
+			self.task = taskMgr.add(self.tskFade, 'fogFade')
+	
+	def tskFade(self, task):
+		step = globalClock.getDt()
+		for sq in list(self.fading):
+			target = self.target[sq]
+			rate = self.rate[sq]
+			if rate is None or abs(target - self.alpha[sq]) <= rate * step:
+				self.alpha[sq] = target
+				self.fading.discard(sq)
+			elif target > self.alpha[sq]:
+				self.alpha[sq] += rate * step
+			else:
+				self.alpha[sq] -= rate * step
+			self.squares.setAlpha(sq, self.alpha[sq])
+			self.setPieceAlpha(sq, self.alpha[sq])
+		self.squares.flush()
+		if self.fading:
+			return Task.cont
+		self.task = None
+		return Task.done
+
+class World(DirectObject):
+	def __init__(self, mode, assets, ip=None):
+		began = time.time()
+		
+		if mode==CLIENT and not ip:
+			#Don't let this happen.
+			log.error("WTF programmer")
+			sys.exit()
+		
+		#current dialog box
+		self.d = None
+		self.assets = assets
+		
+		#top-left of screen; contains instructions on how to exit the game.
+		self.quitInstructions = OnscreenText(text='Press ESC to exit, H for threats, G for a suggestion.', pos=(-1.3, 0.95), scale=0.05, fg=(1,1,1,1), bg=(0,0,0,0), align=TextNode.ALeft, mayChange=False)
+		
+		#bottom of screen
+		self.turnIndicator = OnscreenText(text='', pos=(0,-0.8), scale=0.1, fg=(1,1,1,1), bg=(0,0,0,0), mayChange=True)
+		self.hintText = OnscreenText(text='', pos=(0,-0.9), scale=0.05, fg=(1,1,1,1), bg=(0,0,0,0), mayChange=True)
+		
+		#Saving some values, some default values
+		self.mode = mode
+		self.player = {SERVER: chesscore.WHITE, CLIENT: chesscore.BLACK, COMPUTER: chesscore.WHITE}[self.mode]
+		self.ip = ip
+		
+		#Panda3D, by default, allows for camera control with the mouse.
+		base.disableMouse()
+		
+		self.setupMouse()
+		self.setupBoard()
+		self.setupCamera()
+		self.setupPieces()
+		self.setupRecord()
+		#before the network, which may already show squares at the fade speed the quality sets
+		self.setupLights()
+		
+		#some internal state for making clicky moves
+		self.hiSq = None
+		self.dragOrigin = None
+		
+		#set once an authoritative server starts telling us what we can see (see applyFog)
+		self.authoritative = False
+		#our move, while we wait for an authoritative server to accept it
+		self.pending = None
+		#the squares an authoritative server says we can see
+		self.serverVisible = 0
+		#set once the game has ended on the board
+		self.finished = False
+		
+		#after the state above, which showing the first squares already reads
+		self.setupNetwork()
+		
+		#hints are worked out in the background (see analysis.py); all we keep is what the
+		#player has seen, so that they can't give away anything hidden
+		self.analyst = analysis.Analyst()
+		self.belief = engine.Belief(self.board, self.player)
+		self.showThreats = False
+		taskMgr.add(self.tskAnalysis, "Deliver analysis results")
+		self.accept(analysis.EVENT % 'threats', self.threatsFound)
+		self.accept(analysis.EVENT % 'suggestion', self.suggestionFound)
+		
+		#keyboard, mouse
+		self.mouseTask = taskMgr.add(self.tskMouse, 'mouseTask')
+		self.accept('mouse1', self.handleClick)
+		self.accept('f2', lambda: base.setFrameRateMeter(True))
+		self.accept('f3', lambda: base.setFrameRateMeter(False))
+		self.accept('f4', lambda: log.info(self.quality.governor.report()))
+		#F5 starts and stops the sampling profiler, F6 exports the metrics
+		self.profiler = metrics.Profiler()
+		self.accept('f5', self.profiler.toggle)
+		self.accept('f6', lambda: metrics.export(METRICS or 'metrics.jsonl'))
+		self.accept('escape', sys.exit)
+		self.accept('h', self.toggleThreats)
+		self.accept('g', self.askSuggestion)
+		
+		log.info("Loaded the game in %.0fms", (time.time() - began) * 1000)
+	
+	#### INITIALIZATION ####
+	
+	def setupBoard(self):
+		#We will attach all of the squares to their own root. This way we can do the
+		#collision pass just on the sqaures and save the time of checking the rest
+		#of the scene
+		self.squareRoot = render.attachNewNode("squareRoot")
+		
+		if self.assets.instanced:
+			self.squares = BoardMesh(self.squareRoot, self.assets)
+		else:
+			self.squares = SquareNodes(self.squareRoot, self.assets)
+		
+		#bitboard of the squares that are shown (or being faded in) on screen
+		self.shown = FULL
+		self.fader = FogFader(self.squares, self.setPieceAlpha)
+
+	def setupPieces(self):
+		#The rules live in chesscore; all we keep here is a model for each piece on the board.
+		self.board = Board()
+		self.board.setup()
+		
+		self.models = {}
+		for p in self.board.pieceList():
+			self.addPiece(p)
+		
+		#what our pieces can see, updated after every move
+		self.fog = VisibilityMap(self.board, self.player)
+	
+	def addPiece(self, p):
+		#when instancing, every piece of a kind shares the same geometry and only gets its own
+		#transform, color and alpha
+		self.models[p] = self.assets.node(MODELS[p.__class__])
+		self.models[p].reparentTo(render)
+		self.models[p].setColor(PIECECOLOR[p.color])
+		self.models[p].setPos(SquarePos(p.square))
+		self.models[p].setTransparency(TransparencyAttrib.MAlpha)
+	
+	# Records the game as it is played; a game still going when we quit is recorded as unfinished.
+	# Like the server, we begin the record at the first move, so a session in which nothing is
+	# played leaves nothing behind.
+	def setupRecord(self):
+		self.archive = gamerecord.ArchiveWriter(RECORD)
+		self.record = None
+		#whether we still know the whole board; see stopRecording
+		self.recordable = True
+		atexit.register(self.archive.close)
+
+	# We no longer know every move of the game: we missed some while we were away, or the
+	# server only tells us what we can see. What we have is kept as an unfinished game and the
+	# rest isn't recorded; the server has it all anyway.
+	def stopRecording(self):
+		if self.record:
+			self.record.finish(gamerecord.UNFINISHED)
+		self.recordable = False
+	
+	# If the connection drops or goes quiet (see network.Connection), a client connects again and
+	# asks to carry on with RESUME; a host waits for its client to do so.
+	def setupNetwork(self):
+		#which game we are in, and the key to get back into it, when playing through a game server
+		self.gameId = 0
+		self.seatKey = 0
+		#set once the other side turns out to be another player's client rather than a game
+		#server, by sending a move without a START first
+		self.direct = False
+		self.reconnectDeadline = None
+		if self.mode == COMPUTER:
+			self.setupComputer()
+		elif self.mode == CLIENT:
+			self.setupClient(self.ip)
+		else:
+			self.setupServer()
+	
+	# Sockets are read and written on background threads (see network.py); the tasks below
+	# only ever look at queues, so they never block the frame.
+	def setupServer(self):
+		self.oppConnection = None
+		backlog = 1000
+		self.listener = network.Listener(protocol.PORT, backlog)
+		
+		def tskListenerPoll(task):
+			for newConnection in self.listener.poll():
+				if self.oppConnection:
+					#we only play one game at a time; server.py can host more
+					newConnection.close()
+					continue
+				log.info("Received connection from %s", newConnection.address)
+				self.oppConnection = newConnection
+				
+				#server starts the game, and the client may be coming back to it
+				if self.board.turn == self.player:
+					self.turnIndicator['text'] = 'Your turn!'
+				self.showVisibleSquares()
+				
+				#remove the dialog node from below
+				if self.d: self.d.removeNode()
+				self.d = None
+			if not self.oppConnection and not self.d: self.d = DirectDialog(text="Waiting for client to connect...", buttonTextList=[], buttonValueList=[])
+			return Task.cont
+			
+		taskMgr.add(tskListenerPoll, "Poll the connection listener")
+		taskMgr.add(self.tskReaderPoll, "Poll the connection reader")
+	
+	def setupClient(self, ip):
+		self.oppConnection = None
+		taskMgr.add(self.tskReaderPoll, "Poll the connection reader")
+		self.connect(ip)
+	
+	# Connects to the other player or a game server; with resume, to get back into the game
+	def connect(self, ip, resume=False):
+		timeout = 3.0
+		connector = network.Connector(ip, protocol.PORT, timeout)
+		
+		def tskConnectorPoll(task):
+			myConnection = connector.poll()
+			if myConnection is None:
+				return Task.cont
+			if myConnection:
+				self.oppConnection = myConnection
+				if resume:
+					self.oppConnection.send(protocol.encodeResume(self.gameId, self.seatKey))
+				else:
+					if self.reconnectDeadline is not None:
+						#back in the queue for an opponent, having had no game to lose
+						self.reconnectDeadline = None
+						self.turnIndicator['text'] = ''
+					self.showVisibleSquares()
+			elif self.reconnectDeadline is not None:
+				self.connectionLost()
+			else:
+				self.d = OkDialog(text="Could not connect to server at '%s'" % ip, command=sys.exit)
+			return Task.done
+		
+		taskMgr.add(tskConnectorPoll, "Poll the connector")
+	
+	# A single-player game against engine.py. The computer thinks on its own thread; a task
+	# starts it on the computer's turn and picks up its move once it has one.
+	def setupComputer(self):
+		self.oppConnection = None
+		self.engine = engine.Engine(chesscore.opponent[self.player], self.board)
+		self.search = None
+		#how many moves had been made when the computer last looked at the board
+		self.observedPly = 0
+		
+		self.turnIndicator['text'] = 'Your turn!'
+		self.showVisibleSquares()
+		taskMgr.add(self.tskComputer, "Run the computer player")
+	
+	# Makes sure player gets a decent view of the game board, and *not* of the hidden pieces below the board. Shhhh...
+	def setupCamera(self):
+		if self.player == chesscore.WHITE:
+			camera.setPos(0, -13.75, 8)
+			camera.lookAt(self.squareRoot)
+			camera.setH(0)
+		else:
+			camera.setPos(0, 13.75, 8)
+			camera.lookAt(self.squareRoot)
+			camera.setH(180)
+	
+	# Adds some ambient lights and a directional light
+	def setupLights(self):
+		#This is one area I know hardly anything about. I really don't know how to get this to behave nicely.
+		#The black pieces are hardly distinguishable.
+		ambientLight = AmbientLight( "ambientLight" )
+		ambientLight.setColor( Vec4(.8, .8, .8, 1) )
+		directionalLight = DirectionalLight( "directionalLight" )
+		directionalLight.setDirection( Vec3( 0, 45, -45 ) )
+		directionalLight.setColor( Vec4( 0.2, 0.2, 0.2, 1 ) )
+		#which of them are switched on, and what else is drawn how, is up to the quality tier
+		self.quality = Quality([render.attachNewNode( ambientLight ), render.attachNewNode( directionalLight )])
+	
+	# Sets up picking for the mouse cursor.
+	def setupMouse(self):
+		#The board is the plane z = 0 and every square is a unit cell on it, so the square
+		#under the mouse is just where the mouse's ray meets that plane. No collision pass
+		#is needed.
+		#What the last pick was computed from; while none of it changes, neither does the pick
+		self.lastPick = None
+	
+	# The square under the mouse and the mouse's ray in render's coordinates.
+	# The square is None when the ray misses the board.
+	@metrics.timed('pick')
+	def pickSquare(self, mpos):
+		#Extrude the mouse position into a ray through the camera's lens
+		near = Point3()
+		far = Point3()
+		base.camLens.extrude(mpos, near, far)
+		#The lens works relative to the camera; we want it relative to render
+		nearPoint = render.getRelativePoint(base.cam, near)
+		nearVec = render.getRelativeVector(base.cam, far - near)
+		if nearVec.getZ() >= 0:
+			#pointing level or upwards, so it never reaches the board
+			return None, nearPoint, nearVec
+		point = PointAtZ(0, nearPoint, nearVec)
+		p = (int(math.floor(point.getX() + 4)), int(math.floor(point.getY() + 4)))
+		if not chesscore.onBoard(p):
+			return None, nearPoint, nearVec
+		return p, nearPoint, nearVec
+	
+	#### TASKS ####
+	
+	# Handles everything that has arrived on the connection since the last frame, and notices
+	# when the other side has gone away
+	def tskReaderPoll(self, task):
+		if self.oppConnection:
+			for payload in self.oppConnection.receiveAll():
+				self.receiveData(payload)
+			if self.oppConnection.closed or self.oppConnection.silent():
+				log.warning("Lost connection to %s", self.oppConnection.address)
+				self.oppConnection.close()
+				self.oppConnection = None
+				self.connectionLost()
+		return Task.cont
+	
+	# Passes on each analysis result as a messenger event
+	def tskAnalysis(self, task):
+		for (kind, result) in self.analyst.results():
+			messenger.send(analysis.EVENT % kind, [result])
+		return Task.cont
+	
+	# Shows the computer every position, and collects its move when it's done thinking
+	def tskComputer(self, task):
+		ply = len(self.board.history)
+		if ply != self.observedPly:
+			#it remembers what it saw during our turn too
+			self.observedPly = ply
+			self.engine.observe(self.board)
+			if self.board.turn == self.engine.color and self.board.hasLegalMoves():
+				self.search = self.engine.think(self.board)
+		if self.search:
+			move = self.search.poll()
+			if move:
+				self.search = None
+				self.receiveMove(*move)
+		return Task.cont
+	
+	# Runs every frame, checks whether the mouse is highlighting something or another
+	def tskMouse(self, task):
+		#This task deals with the highlighting and dragging based on the mouse
+		
+		#Nothing to do if neither the mouse nor the game has changed since the last frame
+		if base.mouseWatcherNode.hasMouse():
+			mpos = base.mouseWatcherNode.getMouse()
+			state = (mpos.getX(), mpos.getY(), len(self.board.history), self.board.turn,
+				self.player, self.dragOrigin)
+		else:
+			state = None
+		if state is not None and state == self.lastPick:
+			return Task.cont
+		self.lastPick = state
+		
+		#First, clear the current highlight
+		if self.hiSq:
+			self.squares.setColor(self.hiSq, SquareColor(self.hiSq))
+			self.hiSq = None
+			
+		#Check to see if we can access the mouse. We need it to do anything else
+		if state:
+			p, nearPoint, nearVec = self.pickSquare(mpos)
+			
+			#If we are dragging something, set the position of the object
+			#to be at the appropriate point over the plane of the board
+			if self.dragOrigin:
+				self.models[self.board[self.dragOrigin]].setPos(
+					PointAtZ(.5, nearPoint, nearVec))
+
+			if p:
+				#Legal moves are only generated once per position, so this is just a lookup
+				moves = self.moveTable()
+				if p in moves and self.board.turn == self.player and not self.dragOrigin or self.dragOrigin and p in moves[self.dragOrigin][0]:
+					#Set the highlight on the picked square
+					self.hiSq = p
+					self.squares.setColor(self.hiSq, HIGHLIGHT)
+			    
+		return Task.cont		
+	
+	def handleClick(self):
+		# Disabled when a dialog box is on-screen. Pay attention to what I'm telling you, user!
+		if not self.d:
+			if self.dragOrigin:
+				self.releasePiece()
+			else:
+				self.grabPiece()
+	
+	# Comes from handleClick
+	def grabPiece(self):
+		#If a square is highlighted and it has a piece, set it to dragging mode. Not while there is
+		#nobody to send the move to, though.
+		online = self.oppConnection or self.mode == COMPUTER
+		if self.hiSq and self.hiSq in self.moveTable() and not self.pending and online:
+			self.dragOrigin = self.hiSq
+			self.hiSq = None
+	
+	def releasePiece(self):
+		#Letting go of a piece. If we are not on a square, return it to its original
+		#position.
+		if self.dragOrigin:   #Make sure we really are dragging something
+			valid, legal = self.moveTable()[self.dragOrigin]
+			if self.hiSq and self.hiSq != self.dragOrigin and self.hiSq in valid:
+				
+				# Verify that this doesn't put the king in check. With an authoritative server we
+				# can't: there may be pieces attacking the king that we can't see.
+				if self.hiSq not in legal and not self.authoritative:
+					self.models[self.board[self.dragOrigin]].setPos(SquarePos(self.dragOrigin))
+					log.debug("Invalid move -- King is in check")
+					
+					def closeDialog():
+						self.d.removeNode()
+					self.d = OkDialog(text="That move would put your King in check!", command=closeDialog)
+				elif self.authoritative:
+					#leave the piece where it was dropped until the server says what happened
+					self.models[self.board[self.dragOrigin]].setPos(SquarePos(self.hiSq))
+					self.pending = (self.dragOrigin, self.hiSq)
+					self.sendMove(self.dragOrigin, self.hiSq)
+					self.squares.setColor(self.dragOrigin, SquareColor(self.dragOrigin))
+					self.turnIndicator['text'] = ''
+				else:
+					self.makeMove(self.dragOrigin, self.hiSq, dt=0, callback=self.showVisibleSquares).start()
+					self.sendMove(self.dragOrigin, self.hiSq)
+					self.squares.setColor(self.dragOrigin, SquareColor(self.dragOrigin))
+					
+					#no longer our turn
+					self.turnIndicator['text'] = ''
+			else:
+				self.models[self.board[self.dragOrigin]].setPos(SquarePos(self.dragOrigin))
+				log.debug("Invalid move")
+			  
+		#We are no longer dragging anything
+		self.dragOrigin = False
+	
+	#### CHESS UPDATES ####
+	
+	# Moves a piece from one space to another.
+	# This should be called to update internal state, whether the piece is already in the correct location or not.
+	# Also handles captures. Building the interval is timed, not playing it.
+	@metrics.timed('interval')
+	def makeMove(self, fr, to, dt="default", callback=None):
+		log.debug("Making move %s -> %s", fr, to)
+		if dt == "default": dt = self.quality.tier().animation
+		frP = self.board[fr]
+		toP = self.board[to]
+		
+		if not frP:
+			return False
+		if toP and frP.color == toP.color:
+			return False
+		if not self.board.isValidMove(fr, to):
+			return False
+		
+		# Callback function for the movement.
+		# Updates the true state of the board (self.board)
+		def updateState():
+			if self.record is None and self.recordable:
+				self.record = self.archive.begin(self.board)
+			captured = self.board.makeMove(fr, to)
+			if self.record:
+				self.record.ply(fr, to, captured, self.board)
+			self.destroy(captured)
+			with metrics.timing('visibility'):
+				self.fog.update(fr, to)
+			#the piece takes on the fog of the square it lands on
+			self.setPieceAlpha(to, self.fader.getAlpha(to))
+			
+			def dismiss(val):
+				self.d.removeNode()
+			if not self.board.hasLegalMoves():
+				self.finished = True
+				if self.record:
+					self.record.finish(gamerecord.resultOf(self.board))
+			if self.board.isCheckmate():
+				self.turnIndicator['text'] = 'Checkmate!'
+				if self.board.turn == self.player:
+					self.d = OkDialog(text="Checkmate! You lose.", command=dismiss)
+				else:
+					self.d = OkDialog(text="Checkmate! You win.", command=dismiss)
+			elif self.board.isStalemate():
+				self.turnIndicator['text'] = 'Stalemate!'
+				self.d = OkDialog(text="Stalemate! The game is a draw.", command=dismiss)
+			elif self.inCheck():
+				self.d = OkDialog(text="You are in check!", command=dismiss)
+			self.positionChanged()
+
+		s = Sequence(
+			self.models[frP].posInterval(dt, self.squares.getPos(to)),
+			Func(updateState)
+		)
+		if callback: s.append(Func(callback))
+		return s
+	
+	# The board's moves, timed; only the first call in a position does any work
+	def moveTable(self):
+		with metrics.timing('movegen'):
+			return self.board.moveTable()
+	
+	def inCheck(self):
+		with metrics.timing('inCheck'):
+			return self.board.inCheck(self.player)
+	
+	# Removes the piece. This method is passed a Piece object, not a location!
+	# Possible improvements: Particle effects! :D
+	def destroy(self, piece):
+		if piece:
+			self.models.pop(piece).removeNode()
+
+	#### VISIBILITY UPDATES ####
+	
+	def isVisible(self, sq):
+		return bool(self.shown & bit(sq))
+		
+	def setPieceAlpha(self, sq, alpha):
+		if self.board[sq]:
+			self.models[self.board[sq]].setAlphaScale(alpha)
+	
+	# The next two methods deal with hiding and showing the squares of the board.
+	# The fader does the actual work; all we keep track of is what should be on screen.
+	def hideSquare(self, sq, dt="default"):
+		if self.isVisible(sq):
+			if dt == "default": dt = self.quality.tier().fade
+			self.shown &= ~bit(sq)
+			self.fader.fadeTo(sq, 0.0, dt)
+	
+	def showSquare(self, sq, dt="default"):
+		if not self.isVisible(sq):
+			if dt == "default": dt = self.quality.tier().fade
+			self.shown |= bit(sq)
+			self.fader.fadeTo(sq, 1.0, dt)
+
+	# Shows the path that a piece takes on its way IF any part of it is visible to the current player.
+	# Returns an interval that lasts as long as the squares take to fade in.
+	def showPathIfVisible(self, fr, to):
+		if self.board[fr]:
+			path = self.board[fr].path(to)
+			if any(self.isVisible(sq) for sq in path):
+				return self.showPath(fr, to)
+		return Sequence()
+	
+	# Shows the path that a piece takes on its path from its origin to its destination
+	def showPath(self, fr, to, dt="default"):
+		if dt == "default": dt = self.quality.tier().fade
+		hidden = [sq for sq in self.board[fr].path(to) if not self.isVisible(sq)] if self.board[fr] else []
+		for sq in hidden:
+			self.showSquare(sq, dt)
+		return Wait(dt) if hidden else Sequence()
+	
+	# The squares we can see right now
+	def visible(self):
+		return self.serverVisible if self.authoritative else self.fog.visible
+	
+	# Updates the board to show only the squares that are visible at the current time.
+	# Only the squares whose visibility differs from what is on screen are touched.
+	def showVisibleSquares(self, dt="default"):
+		visibles = self.visible()
+		for s in SquareSet(visibles ^ self.shown):
+			if visibles & bit(s):
+				self.showSquare(s, dt)
+			else:
+				self.hideSquare(s, dt)
+	
+	#### NETWORK I/O ####
+	@metrics.timed('send')
+	def sendMove(self, fr, to):
+		if not self.oppConnection:
+			#the computer player watches the board for itself
+			return
+		log.debug("Sent move (%d, %d) -> (%d, %d)", fr[0], fr[1], to[0], to[1])
+		self.oppConnection.send(protocol.encodeMove(fr, to))
+		metrics.count('sent')
+	
+	@metrics.timed('receive')
+	def receiveData(self, data):
+		if not data:
+			return
+		metrics.count('received')
+		kind = protocol.messageType(data)
+		if kind is None:
+			if not self.gameId:
+				self.direct = True
+			self.receiveMove(*protocol.decodeMove(data))
+		elif kind == protocol.START:
+			self.startGame(*protocol.decodeStart(data))
+		elif kind == protocol.FOG:
+			self.applyFog(*protocol.decodeFog(data))
+		elif kind == protocol.REJECT:
+			self.moveRejected(*protocol.decodeReject(data))
+		elif kind == protocol.SNAPSHOT:
+			self.applySnapshot(*protocol.decodeSnapshot(data))
+		elif kind == protocol.REQUEUE:
+			self.gameCalledOff()
+		elif kind == protocol.ABANDONED:
+			self.opponentLeft()
+		elif kind == protocol.RESUME and self.mode == SERVER:
+			self.sendSnapshot()
+	
+	# Tries to get back into the game, every so often, for RECONNECT seconds. A host just goes
+	# back to waiting for its client. Before a game server has given us a seat there is no game
+	# to get back into, so we just connect again as a new player.
+	def connectionLost(self):
+		if self.mode != CLIENT or self.finished:
+			return
+		if self.reconnectDeadline is None:
+			self.reconnectDeadline = time.time() + RECONNECT
+		if time.time() > self.reconnectDeadline:
+			self.turnIndicator['text'] = ''
+			self.d = OkDialog(text="Lost the connection to '%s'" % self.ip, command=sys.exit)
+			return
+		self.turnIndicator['text'] = 'Reconnecting...'
+		resume = bool(self.gameId) or self.direct
+		taskMgr.doMethodLater(1.0, lambda task: self.connect(self.ip, resume), "Reconnect")
+	
+	# Our client has come back after losing its connection, and needs to know where the game is
+	def sendSnapshot(self):
+		codes = [pieceCode(p) for p in self.board.pieces]
+		self.oppConnection.send(protocol.encodeSnapshot(0, self.board.turn, len(self.board.history), codes))
+	
+	# Where the game has got to, after we lost our connection and made a new one
+	def applySnapshot(self, gameId, turn, ply, codes):
+		log.info("Resumed game %d at move %d", gameId, ply)
+		self.reconnectDeadline = None
+		if self.pending:
+			#the move may never have got there; if it did, the snapshot will show it
+			fr, to = self.pending
+			self.pending = None
+			self.models[self.board[fr]].setPos(SquarePos(fr))
+		if self.placePieces([(square(i), codes[i]) for i in xrange(64)]) and not self.authoritative:
+			#we missed moves while we were gone, so our record of the game has a gap in it
+			self.stopRecording()
+		self.board.turn = turn
+		self.board.table = None
+		if not self.authoritative:
+			self.fog = VisibilityMap(self.board, self.player)
+		self.showVisibleSquares()
+		self.turnIndicator['text'] = 'Your turn!' if turn == self.player else ''
+		self.positionChanged()
+	
+	# Puts pieces on the board to match a list of ((x, y), code or None), None being a square
+	# out of sight, and returns whether anything changed
+	def placePieces(self, changes):
+		changed = False
+		for (sq, code) in changes:
+			p = self.board[sq]
+			if (pieceCode(p) if p else 0) != (code or 0):
+				changed = True
+				if p:
+					self.destroy(p)
+					self.board[sq] = None
+				if code:
+					p = pieceFromCode(code, sq)
+					self.board[sq] = p
+					self.addPiece(p)
+					self.setPieceAlpha(sq, self.fader.getAlpha(sq))
+			if code is None:
+				self.serverVisible &= ~bit(sq)
+			else:
+				self.serverVisible |= bit(sq)
+		return changed
+	
+	# A game server (see server.py) tells each of its players which side they are playing
+	def startGame(self, color, gameId, key):
+		if self.reconnectDeadline is not None:
+			#we are getting back into our own game, not starting another
+			log.info("Ignored the start of game %d while resuming", gameId)
+			return
+		log.info("Joined game %d", gameId)
+		self.gameId = gameId
+		self.seatKey = key
+		self.player = color
+		self.setupCamera()
+		self.fog = VisibilityMap(self.board, self.player)
+		self.belief = engine.Belief(self.board, self.player)
+		self.showVisibleSquares()
+		if self.board.turn == self.player:
+			self.turnIndicator['text'] = 'Your turn!'
+	
+	# A game server called off the game it had just put us in, before anyone moved. We go back
+	# to the opening position and wait for the START of another.
+	def gameCalledOff(self):
+		log.info("Game %d was called off", self.gameId)
+		self.gameId = 0
+		self.seatKey = 0
+		self.pending = None
+		opening = Board()
+		opening.setup()
+		self.placePieces([(square(i), pieceCode(p) if p else 0) for (i, p) in enumerate(opening.pieces)])
+		if self.record:
+			#a move of ours made it onto the board before the server called the game off; the
+			#next game's record begins at its own first move
+			self.record.finish(gamerecord.UNFINISHED)
+			self.record = None
+		self.board.turn = opening.turn
+		self.board.table = None
+		self.board.history = []
+		self.board.keys = []
+		self.authoritative = False
+		self.serverVisible = 0
+		self.fog = VisibilityMap(self.board, self.player)
+		self.showVisibleSquares()
+		self.turnIndicator['text'] = 'Waiting for an opponent...'
+		self.positionChanged()
+	
+	# An authoritative server's account of what has changed in our view of the board. From the
+	# first one on, the board holds only our own pieces and the enemy pieces we can see, and the
+	# server works out visibility, check and the end of the game for us.
+	def applyFog(self, turn, flags, changes):
+		first = not self.authoritative
+		if first:
+			#forget the opening position; the first update lists everything we can see
+			self.authoritative = True
+			self.stopRecording()
+			for p in self.board.pieceList():
+				self.destroy(p)
+				self.board[p.square] = None
+		self.pending = None
+		
+		self.placePieces(changes)
+		self.board.turn = turn
+		self.board.table = None
+		self.showVisibleSquares()
+		self.positionChanged()
+		
+		def dismiss(val):
+			self.d.removeNode()
+		self.finished = bool(flags & (gamerecord.CHECKMATE | gamerecord.STALEMATE))
+		if flags & gamerecord.CHECKMATE:
+			self.turnIndicator['text'] = 'Checkmate!'
+			if turn == self.player:
+				self.d = OkDialog(text="Checkmate! You lose.", command=dismiss)
+			else:
+				self.d = OkDialog(text="Checkmate! You win.", command=dismiss)
+		elif flags & gamerecord.STALEMATE:
+			self.turnIndicator['text'] = 'Stalemate!'
+			self.d = OkDialog(text="Stalemate! The game is a draw.", command=dismiss)
+		elif turn == self.player:
+			self.turnIndicator['text'] = 'Your turn!'
+			if flags & gamerecord.CHECK:
+				self.d = OkDialog(text="You are in check!", command=dismiss)
+			if not first:
+				self.assets.play('audio/ding.wav')
+	
+	# A game server gave up on our opponent coming back, and is closing the connection
+	def opponentLeft(self):
+		if self.finished:
+			return
+		log.info("Game %d abandoned by the opponent", self.gameId)
+		self.finished = True
+		if self.record:
+			self.record.finish(gamerecord.UNFINISHED)
+		self.turnIndicator['text'] = 'Your opponent left.'
+		
+		def dismiss(val):
+			self.d.removeNode()
+		self.d = OkDialog(text="Your opponent left the game.", command=dismiss)
+	
+	# An authoritative server refused our move, most likely because of a check we couldn't see
+	def moveRejected(self, fr, to):
+		log.info("Move %s -> %s rejected", fr, to)
+		self.pending = None
+		if self.board[fr]:
+			self.models[self.board[fr]].setPos(SquarePos(fr))
+		self.turnIndicator['text'] = 'Your turn!'
+		
+		def closeDialog():
+			self.d.removeNode()
+		self.d = OkDialog(text="That move would put your King in check!", command=closeDialog)
+	
+	#### HINTS ####
+	
+	# Forgets any analysis of the old position, and starts on the new one
+	def positionChanged(self):
+		self.analyst.newPosition()
+		self.belief.observe(self.board)
+		self.hintText['text'] = ''
+		if self.showThreats:
+			self.analyst.submit('threats', analysis.snapshot(self.board, self.visible()), self.player)
+	
+	def toggleThreats(self):
+		self.showThreats = not self.showThreats
+		self.positionChanged()
+	
+	# Asks the engine what it would do in our place, knowing only what we know
+	def askSuggestion(self):
+		if self.board.turn != self.player or self.finished:
+			return
+		world = self.belief.determinize(self.board, random, 0)
+		if world:
+			self.hintText['text'] = 'Thinking...'
+			self.analyst.submit('suggestion', world)
+	
+	def threatsFound(self, threatened):
+		names = [SquareName(square(i)) for i in indices(threatened)]
+		self.hintText['text'] = 'Under attack: ' + ', '.join(names) if names else 'Nothing under attack'
+	
+	def suggestionFound(self, move):
+		self.hintText['text'] = 'Try %s-%s' % (SquareName(move[0]), SquareName(move[1])) if move else ''
+	
+	def receiveMove(self, fr, to):
+		log.debug("Received move %s -> %s", fr, to)
+
+		def indicate():
+			if not self.board.hasLegalMoves():
+				#the game is over; updateState has already said so
+				return
+			self.turnIndicator['text'] = 'Your turn!'
+			self.assets.play('audio/ding.wav')
+
+		seq = Sequence()
+		seq.append(self.showPathIfVisible(fr, to))
+		seq.append(self.makeMove(fr, to))
+		seq.append(Func(indicate))
+		seq.append(Func(self.showVisibleSquares))
+
+		seq.start()
+	
+class SetupMenu:
+	def __init__(self, assets):
+		self.assets = assets
+		self.showCSDialog()
+	
+	def showCSDialog(self):
+		def submit(mode):
+			d.removeNode()
+			self.mode = mode
+			if self.mode in (SERVER, COMPUTER):
+				w = World(self.mode, self.assets)
+			else:
+				self.showIPDialog()
+				
+		d = DirectDialog(dialogName='ClientServerDialog', text='Please choose:', buttonTextList=['Client', 'Server', 'Computer'], buttonValueList=[CLIENT, SERVER, COMPUTER], command=submit, fadeScreen=1)
+	
+	def showIPDialog(self):
+		def submitIP(addr):
+			log.info("Connecting to %s", addr)
+			ip.removeNode()
+			self.ip = addr
+			w = World(self.mode, self.assets, self.ip)
+			
+		ip = DirectDialog(dialogName='IPDialog', text='Please enter the server IP address:', buttonTextList=[], buttonValueList=[], command=None, fadeScreen=1)
+		tb = DirectEntry(text="", scale=.05, command=submitIP, initialText="", numLines=1, focus=1, pos=(-0.25,0,-0.15))
+		tb.reparentTo(ip)
+	
+# Opens the window and shows the menu. Models and sounds load a frame at a time behind the
+# menu (see assets.py). "start" is when the program started, for the startup timings.
+def main(start):
+	imported = time.time()
+	metrics.setupLogging()
+	ShowBase()
+	opened = time.time()
+	assets = Assets(INSTANCED)
+	SetupMenu(assets)
+	assets.preload()
+	
+	def tskStartup(task):
+		now = time.time()
+		log.info("Started in %.0fms: Panda3D %.0fms, window %.0fms, first frame %.0fms",
+			(now - start) * 1000, (imported - start) * 1000, (opened - imported) * 1000, (now - opened) * 1000)
+		return Task.done
+	taskMgr.add(tskStartup, "Report the startup time")
+	
+	def tskReport(task):
+		metrics.snapshot()
+		if METRICS:
+			metrics.export(METRICS)
+		metrics.flushLog()
+		return Task.again
+	taskMgr.doMethodLater(metrics.REPORT, tskReport, "Snapshot the metrics")
+	base.run()
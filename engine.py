@@ -0,0 +1,321 @@
+# A computer opponent that plays under the same fog as a human.
+# It never looks at the enemy pieces it can't see. Instead it keeps a belief: where each
+# enemy piece was last seen. When it has to move, it turns that belief into a few complete
+# positions ("determinizations"). Some are the belief as it stands, and in others the pieces
+# hiding in the fog have wandered. It searches each one with alpha-beta and iterative
+# deepening until its time runs out, then plays the move that did best on average.
+#
+# A Search runs on a background thread and is polled like network.Connector, so the render
+# thread never waits on it.
+
+import time
+import random
+import threading
+import Queue
+
+from chesscore import Board, WHITE, BLACK, opponent, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, pieceCode, pieceFromCode
+from bitboard import FULL, bit, indices, popcount, square
+from zobrist import TranspositionTable
+
+#centipawns
+VALUES = [100, 320, 330, 500, 900, 0]
+MATE = 100000
+INFINITY = 1000000
+
+#how far each square is from the edge of the board, for centralising pieces
+CENTER = [min(x, 7 - x) + min(y, 7 - y) for y in xrange(8) for x in xrange(8)]
+
+#how many plies of captures to look at past the end of the search
+QUIESCENCE = 4
+
+#what a stored search score says about the position's real score
+EXACT, LOWER, UPPER = range(3)
+
+# Mate scores count plies from the root of the search, but the table may be asked about the
+# same position at another distance from the root, so it stores them counted from the
+# position itself
+def toTable(score, ply):
+	if score > MATE - 1000: return score + ply
+	if score < 1000 - MATE: return score - ply
+	return score
+
+def fromTable(score, ply):
+	if score > MATE - 1000: return score - ply
+	if score < 1000 - MATE: return score + ply
+	return score
+
+class Timeout(Exception):
+	pass
+
+# The number of king moves between two squares
+def distance((x1, y1), (x2, y2)):
+	return max(abs(x1 - x2), abs(y1 - y2))
+
+# Scores a position from the side to move's point of view
+def evaluate(board):
+	score = 0
+	for color in (WHITE, BLACK):
+		bb = board.bitboards[color]
+		side = 0
+		for kind in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN):
+			side += VALUES[kind] * popcount(bb[kind])
+		#pawns can't promote, so there is only so much to be gained by pushing them
+		for i in indices(bb[PAWN]):
+			rank = i >> 3 if color == WHITE else 7 - (i >> 3)
+			side += 4 * min(rank - 1, 4)
+		for i in indices(bb[KNIGHT] | bb[BISHOP]):
+			side += 4 * CENTER[i]
+		score += side if color == board.turn else -side
+	return score
+
+# What one side knows about the other side's pieces
+class Belief:
+	def __init__(self, board, color):
+		self.color = color
+		#the kind of enemy piece last seen on each square; at the start of the game that's all of them
+		self.enemy = dict((p.square, p.kind) for p in board.pieceList(opponent[color]))
+		self.visible = 0
+		self.observe(board)
+
+	# Takes in what can be seen of the board right now, and nothing else
+	def observe(self, board):
+		self.visible = board.visibleMask(self.color)
+		seen = {}
+		for i in indices(self.visible):
+			p = board[square(i)]
+			if p and p.color != self.color:
+				seen[p.square] = p.kind
+		newcomers = [(sq, kind) for (sq, kind) in seen.items() if self.enemy.get(sq) != kind]
+		#pieces last seen on squares we can see again, that aren't there any more
+		missing = {}
+		for i in indices(self.visible):
+			sq = square(i)
+			kind = self.enemy.pop(sq, None)
+			if kind is not None and seen.get(sq) != kind:
+				missing[sq] = kind
+		for (sq, kind) in newcomers:
+			#a piece turning up somewhere new has probably come from the nearest place one like it
+			#went missing, or failing that, the nearest place one like it was last seen
+			for last in (missing, self.enemy):
+				candidates = [s for (s, k) in last.items() if k == kind]
+				if candidates:
+					del last[min(candidates, key=lambda s: distance(s, sq))]
+					break
+		self.enemy.update(seen)
+		for (sq, kind) in missing.items():
+			if kind != KING and board[sq] and board[sq].color == self.color:
+				#we took it
+				continue
+			#otherwise it has slipped into the fog, most likely somewhere close by
+			free = [square(i) for i in indices(FULL & ~self.visible) if square(i) not in self.enemy]
+			if free:
+				self.enemy[min(free, key=lambda s: distance(s, sq))] = kind
+
+	# A complete position built from our own pieces and the belief. With probability "spread",
+	# each enemy piece out of sight makes one move to another square out of sight.
+	def determinize(self, board, rand, spread):
+		world = Board()
+		for p in board.pieceList(self.color):
+			piece = pieceFromCode(pieceCode(p), p.square)
+			piece.haveMoved = p.haveMoved
+			world[p.square] = piece
+		them = opponent[self.color]
+		for (sq, kind) in self.enemy.items():
+			world[sq] = pieceFromCode(1 + kind + 6 * them, sq)
+		world.turn = board.turn
+
+		hidden = FULL & ~self.visible
+		for p in world.pieceList(them):
+			if not hidden & bit(p.square) or rand.random() >= spread:
+				continue
+			targets = list(indices(p.moveMask(world) & hidden & ~world.occupiedAll()))
+			if targets:
+				to = square(rand.choice(targets))
+				world[p.square] = None
+				p.move(to)
+				world[to] = p
+		world.table = None
+
+		#a belief can't lose their king or leave it in check on our move, but don't trust it to
+		if world.kings[them] is None or world.inCheck(them):
+			return None
+		return world
+
+class Engine:
+	def __init__(self, color, board, budget=1.0, samples=4, spread=0.3, maxDepth=6):
+		self.color = color
+		#seconds to think about each move
+		self.budget = budget
+		#how many determinizations to search
+		self.samples = samples
+		self.spread = spread
+		self.maxDepth = maxDepth
+		self.belief = Belief(board, color)
+		self.rand = random.Random()
+		#search results, kept from one move to the next
+		self.table = TranspositionTable(14)
+
+	# Call after every move, so that pieces seen only in passing are remembered
+	def observe(self, board):
+		self.belief.observe(board)
+
+	# Starts thinking about the position on the board; poll the result for the move.
+	# Must be called from the thread that owns the board: everything the search needs is
+	# copied out of it before the search thread starts.
+	def think(self, board):
+		self.observe(board)
+		#the rules say which of our own moves are legal, as they would to a human player
+		moves = board.legalMoves()
+		worlds = [self.belief.determinize(board, self.rand, 0 if n == 0 else self.spread) for n in xrange(self.samples)]
+		return Search([w for w in worlds if w], moves, self.table, self.budget, self.maxDepth, self.rand.random())
+
+	# Thinks on the calling thread and returns the move
+	def chooseMove(self, board):
+		return self.think(board).wait()
+
+# Searches a set of determinized positions on a background thread
+class Search:
+	def __init__(self, worlds, moves, table, budget, maxDepth, seed, cancelled=None):
+		self.worlds = worlds
+		self.moves = moves
+		self.table = table
+		self.budget = budget
+		self.maxDepth = maxDepth
+		self.rand = random.Random(seed)
+		self.nodes = 0
+		self.depth = 0
+		self.result = Queue.Queue()
+		#asked every so often whether to stop early, as if out of time
+		self.cancelled = cancelled
+
+		thread = threading.Thread(target=self.run, name='search')
+		thread.daemon = True
+		thread.start()
+
+	# None while still thinking, then the chosen move
+	def poll(self):
+		try:
+			return self.result.get_nowait()
+		except Queue.Empty:
+			return None
+
+	def wait(self):
+		return self.result.get()
+
+	def run(self):
+		if not self.moves:
+			self.result.put(None)
+			return
+		self.deadline = time.time() + self.budget
+		best = None
+		try:
+			for depth in xrange(1, self.maxDepth + 1):
+				totals = dict((m, []) for m in self.moves)
+				for world in self.worlds:
+					self.searchRoot(world, depth, totals)
+				best = self.pick(totals)
+				self.depth = depth
+		except Timeout:
+			if best is None:
+				#not even the shallowest search finished, so make do with the moves it got to
+				best = self.pick(totals)
+		self.result.put(best)
+
+	# The move with the best average score over the worlds in which it could be tried
+	def pick(self, totals):
+		averages = dict((m, sum(s) / float(len(s)) if s else -INFINITY) for (m, s) in totals.iteritems())
+		top = max(averages.itervalues())
+		return self.rand.choice([m for m in self.moves if averages[m] == top])
+
+	# Scores every one of our legal moves in one determinization, adding the scores to totals
+	def searchRoot(self, world, depth, totals):
+		legal = set(world.legalMoves())
+		for m in self.moves:
+			if m not in legal:
+				#our belief is wrong somewhere; this world can't tell us anything about the move
+				continue
+			world.makeMove(*m)
+			try:
+				totals[m].append(-self.alphaBeta(world, depth - 1, 1, -INFINITY, INFINITY))
+			finally:
+				world.unmakeMove()
+
+	# The best move found last time first, then captures, most valuable victim by least
+	# valuable attacker
+	def ordered(self, board, moves, hint=None):
+		def key(move):
+			if move == hint:
+				return -INFINITY
+			victim = board[move[1]]
+			return -(VALUES[victim.kind] * 10 - VALUES[board[move[0]].kind]) if victim else 0
+		return sorted(moves, key=key)
+
+	def tick(self):
+		self.nodes += 1
+		if not self.nodes & 255 and (time.time() > self.deadline or self.cancelled and self.cancelled()):
+			raise Timeout()
+
+	def alphaBeta(self, board, depth, ply, alpha, beta):
+		self.tick()
+		if board.repetitions():
+			#going round in circles gets nobody anywhere
+			return 0
+		key = board.positionKey()
+		hint = None
+		entry = self.table.get(key)
+		if entry:
+			stored, bound, score, hint = entry
+			score = fromTable(score, ply)
+			if stored >= depth and (bound == EXACT or bound == LOWER and score >= beta or bound == UPPER and score <= alpha):
+				return score
+		moves = board.legalMoves()
+		if not moves:
+			return -(MATE - ply) if board.inCheck(board.turn) else 0
+		if depth <= 0:
+			return self.quiesce(board, QUIESCENCE, alpha, beta)
+		original = alpha
+		best = -INFINITY
+		bestMove = None
+		for (fr, to) in self.ordered(board, moves, hint):
+			board.makeMove(fr, to)
+			try:
+				score = -self.alphaBeta(board, depth - 1, ply + 1, -beta, -alpha)
+			finally:
+				board.unmakeMove()
+			if score > best:
+				best = score
+				bestMove = (fr, to)
+			if score > alpha:
+				alpha = score
+			if alpha >= beta:
+				break
+		bound = LOWER if best >= beta else UPPER if best <= original else EXACT
+		self.table.put(key, (depth, bound, toTable(best, ply), bestMove))
+		return best
+
+	# Plays out captures until the position is quiet, so a search doesn't stop halfway through a trade
+	def quiesce(self, board, depth, alpha, beta):
+		standPat = evaluate(board)
+		if standPat >= beta or depth == 0:
+			return standPat
+		alpha = max(alpha, standPat)
+		#only the captures, straight from the move table rather than from the list of every move
+		them = board.occupied[opponent[board.turn]]
+		captures = [(fr, square(i)) for (fr, (valid, legal)) in board.moveTable().iteritems() for i in indices(legal & them)]
+		for (fr, to) in self.ordered(board, captures):
+			board.makeMove(fr, to)
+			try:
+				self.tick()
+				if board.hasLegalMoves():
+					score = -self.quiesce(board, depth - 1, -beta, -alpha)
+				elif board.inCheck(board.turn):
+					score = MATE
+				else:
+					score = 0
+			finally:
+				board.unmakeMove()
+			if score >= beta:
+				return score
+			if score > alpha:
+				alpha = score
+		return alpha
@@ -0,0 +1,297 @@
+# An append-only archive of finished and in-progress games.
+# The archive is two files. The data file holds the games themselves. Each game is a
+# fixed-size header followed by one fixed-size record per ply: the move, the piece it took,
+# whether it gave check or ended the game, and which squares each side's view gained or lost.
+# The index file ("<data>.idx") has one fixed-size entry per game: where the game starts in
+# the data file, how many plies it has, and how it ended. Because every record has a fixed
+# size, a reader can go straight to any game or any ply through a memory map without parsing
+# anything in front of it.
+#
+# A game's plies are kept in chunks of room for a fixed number of them, each chunk saying how
+# many it holds and where the next one is. A game played live is indexed as soon as it
+# begins, and each ply is written into its chunk, and counted in the index, as it is made, so
+# a server that dies mid-game loses at most the move in hand; when a chunk fills up, the next
+# one goes at the end of the file. A game added whole gets a single chunk just big enough.
+# Several processes may add to the same archive: every write is made under an exclusive lock
+# on the data file, and anything new goes at the end the file really has.
+
+import os
+import mmap
+import struct
+import contextlib
+
+try:
+	import fcntl
+except ImportError:
+	#no locking on Windows; processes there need archives of their own
+	fcntl = None
+
+from chesscore import WHITE, BLACK, pieceCode
+from bitboard import index, square
+from visibility import VisibilityMap
+
+MAGIC = 'FOWREC02'
+
+#magic, then what each side could see before the first move
+HEADER = struct.Struct('<4sQQ')
+GAME = 'GAME'
+#room for how many plies, offset of the next chunk in the data file or 0 for none
+CHUNK = struct.Struct('<IQ')
+#from, to, piece taken, flags, then the squares whose visibility flipped for white and for black
+PLY = struct.Struct('<BBBBQQ')
+#offset of the game's header in the data file, number of plies, result
+INDEX = struct.Struct('<QIB3x')
+
+#ply flags
+CHECK = 1
+CHECKMATE = 2
+STALEMATE = 4
+
+#results
+WHITE_WINS = 0
+BLACK_WINS = 1
+DRAWN = 2 #stalemate
+UNFINISHED = 3 #abandoned, disconnected or stopped at a ply limit
+
+RESULTS = ['1-0', '0-1', '1/2-1/2', '*']
+
+#plies per chunk for games written as they are played
+CHUNK_PLIES = 32
+
+#### WRITING ####
+
+# Turns the moves of one game into records, starting from the board as it is now. Every move
+# made on that board from then on has to be passed to encodePly, which keeps each side's
+# visibility up to date incrementally (see visibility.py).
+class GameEncoder:
+	def __init__(self, board):
+		self.fog = [VisibilityMap(board, WHITE), VisibilityMap(board, BLACK)]
+		self.header = HEADER.pack(GAME, self.fog[WHITE].visible, self.fog[BLACK].visible)
+		self.plies = 0
+
+	# The record for a move that has just been made on the board; "captured" is what
+	# Board.makeMove returned
+	def encodePly(self, fr, to, captured, board):
+		flipped = []
+		for fog in self.fog:
+			revealed, hidden = fog.update(fr, to)
+			flipped.append(revealed | hidden)
+		record = PLY.pack(index(fr), index(to), pieceCode(captured), statusFlags(board), flipped[WHITE], flipped[BLACK])
+		self.plies += 1
+		return record
+
+# CHECK, CHECKMATE or STALEMATE for the side to move, or 0
+def statusFlags(board):
+	flags = 0
+	if board.inCheck(board.turn):
+		flags |= CHECK
+	if not board.hasLegalMoves():
+		flags |= CHECKMATE if flags & CHECK else STALEMATE
+	return flags
+
+# The result of a game from its final position, for games that ended on the board
+def resultOf(board):
+	if board.hasLegalMoves():
+		return UNFINISHED
+	if board.inCheck(board.turn):
+		return BLACK_WINS if board.turn == WHITE else WHITE_WINS
+	return DRAWN
+
+# A game being written to an archive as it is played
+class GameWriter(GameEncoder):
+	def __init__(self, archive, board):
+		GameEncoder.__init__(self, board)
+		self.archive = archive
+		#where the game and its index entry are, its last chunk, and how many plies that chunk holds
+		self.offset = None
+		self.indexAt = None
+		self.chunkAt = None
+		self.used = 0
+		self.result = None
+
+	# Call after each move has been made on the board
+	def ply(self, fr, to, captured, board):
+		if self.result is None:
+			self.archive.ply(self, self.encodePly(fr, to, captured, board))
+
+	def finish(self, result):
+		if self.result is None:
+			self.result = result
+			self.archive.finish(self)
+
+class ArchiveWriter:
+	def __init__(self, path):
+		self.path = path
+		#opened for update, since plies and index entries are filled in after they are added
+		for name in (path, path + '.idx'):
+			open(name, 'ab').close()
+		self.data = open(path, 'r+b')
+		self.index = open(path + '.idx', 'r+b')
+		#games in progress
+		self.open = []
+
+	# Holds the lock for one write, and makes sure it is out of our buffers before letting go.
+	# Another process may have added to the files since we last did, so anything new has to go
+	# at the end as it is now.
+	@contextlib.contextmanager
+	def locked(self):
+		if fcntl:
+			fcntl.flock(self.data.fileno(), fcntl.LOCK_EX)
+		try:
+			yield
+			#the plies before the index entry that counts them
+			self.data.flush()
+			self.index.flush()
+		finally:
+			if fcntl:
+				fcntl.flock(self.data.fileno(), fcntl.LOCK_UN)
+
+	# Adds data to the end of the data file and returns where it went
+	def extend(self, data):
+		self.data.seek(0, os.SEEK_END)
+		if not self.data.tell():
+			self.data.write(MAGIC)
+		offset = self.data.tell()
+		self.data.write(data)
+		return offset
+
+	# Adds an entry to the end of the index and returns where it went
+	def enter(self, offset, plies, result):
+		self.index.seek(0, os.SEEK_END)
+		at = self.index.tell()
+		self.index.write(INDEX.pack(offset, plies, result))
+		return at
+
+	# A chunk with room for "capacity" plies, none of them filled in yet
+	def chunk(self, capacity):
+		return CHUNK.pack(capacity, 0) + '\0' * (capacity * PLY.size)
+
+	# Starts recording a game from the board as it is now
+	def begin(self, board):
+		game = GameWriter(self, board)
+		with self.locked():
+			offset = self.extend(game.header + self.chunk(CHUNK_PLIES))
+			game.offset = offset
+			game.chunkAt = offset + HEADER.size
+			game.indexAt = self.enter(offset, 0, UNFINISHED)
+		self.open.append(game)
+		return game
+
+	# Adds a whole finished game at once: the header and plies from a GameEncoder
+	def append(self, data, plies, result):
+		with self.locked():
+			offset = self.extend(data[:HEADER.size] + CHUNK.pack(plies, 0) + data[HEADER.size:])
+			self.enter(offset, plies, result)
+
+	def ply(self, game, record):
+		with self.locked():
+			if game.used == CHUNK_PLIES:
+				chunkAt = self.extend(self.chunk(CHUNK_PLIES))
+				#link the full chunk to the new one
+				self.data.seek(game.chunkAt)
+				self.data.write(CHUNK.pack(CHUNK_PLIES, chunkAt))
+				game.chunkAt = chunkAt
+				game.used = 0
+			self.data.seek(game.chunkAt + CHUNK.size + game.used * PLY.size)
+			self.data.write(record)
+			game.used += 1
+			self.index.seek(game.indexAt)
+			self.index.write(INDEX.pack(game.offset, game.plies, UNFINISHED))
+
+	def finish(self, game):
+		self.open.remove(game)
+		with self.locked():
+			self.index.seek(game.indexAt)
+			self.index.write(INDEX.pack(game.offset, game.plies, game.result))
+
+	# Finishes any games still in progress as unfinished
+	def close(self):
+		for game in list(self.open):
+			game.finish(UNFINISHED)
+		self.data.close()
+		self.index.close()
+
+#### READING ####
+
+def _map(f):
+	if not os.fstat(f.fileno()).st_size:
+		return ''
+	return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class ArchiveReader:
+	def __init__(self, path):
+		self.dataFile = open(path, 'rb')
+		self.indexFile = open(path + '.idx', 'rb')
+		self.data = _map(self.dataFile)
+		self.index = _map(self.indexFile)
+		if self.data[:len(MAGIC)] != MAGIC:
+			raise ValueError("%s is not a game archive" % path)
+
+	def __len__(self):
+		return len(self.index) // INDEX.size
+
+	def __getitem__(self, g):
+		if not 0 <= g < len(self):
+			raise IndexError(g)
+		offset, plies, result = INDEX.unpack_from(self.index, g * INDEX.size)
+		return GameView(self.data, offset, plies, result)
+
+	def __iter__(self):
+		for g in xrange(len(self)):
+			yield self[g]
+
+	def close(self):
+		for m in (self.data, self.index):
+			if m:
+				m.close()
+		self.dataFile.close()
+		self.indexFile.close()
+
+# One game in an archive, read straight out of the memory map
+class GameView:
+	def __init__(self, data, offset, plies, result):
+		self.data = data
+		self.offset = offset
+		self.plies = plies
+		self.result = result
+		magic, white, black = HEADER.unpack_from(data, offset)
+		if magic != GAME:
+			raise ValueError("no game at offset %d" % offset)
+		self.start = [white, black]
+		#(offset of the first ply, room for how many) for each chunk the plies are in
+		self.chunks = []
+		at = offset + HEADER.size
+		left = plies
+		while left > 0:
+			if not at:
+				raise ValueError("game at offset %d is missing plies" % offset)
+			capacity, following = CHUNK.unpack_from(data, at)
+			self.chunks.append((at + CHUNK.size, capacity))
+			left -= capacity
+			at = following
+
+	def __len__(self):
+		return self.plies
+
+	# (from, to, piece code taken, flags, white visibility flipped, black visibility flipped)
+	def record(self, ply):
+		if not 0 <= ply < self.plies:
+			raise IndexError(ply)
+		for (at, capacity) in self.chunks:
+			if ply < capacity:
+				return PLY.unpack_from(self.data, at + ply * PLY.size)
+			ply -= capacity
+
+	def move(self, ply):
+		fr, to = self.record(ply)[:2]
+		return square(fr), square(to)
+
+	def moves(self):
+		return [self.move(ply) for ply in xrange(self.plies)]
+
+	# What side "color" could see after the first "ply" plies, as a bitboard
+	def visibility(self, ply, color):
+		visible = self.start[color]
+		for k in xrange(ply):
+			visible ^= self.record(k)[4 + color]
+		return visible
@@ -0,0 +1,237 @@
+# Counters, latency histograms, a sampling profiler and the log, cheap enough to leave on.
+# Counters and histograms are plain module-level tables, so recording into them is an
+# addition or two, under a lock since any thread may record. A histogram has power-of-two
+# buckets in microseconds and never grows. snapshot() copies the current figures into a ring
+# buffer, and export() writes out the snapshots not exported before, to a file or by HTTP
+# POST, on a thread of its own.
+#
+# Timing is added where something is called, not to the thing called: timed() wraps a
+# function, and timing() a block of code. The client times the rules where it calls them, so
+# the server, self-play, perft and the client's own background threads run them untimed.
+#
+# The sampling profiler looks at one thread's stack every few milliseconds, from another
+# thread, and counts where it finds it. It can be started and stopped while the game runs.
+#
+# The log keeps records in memory and writes them out in batches, so logging a move doesn't
+# mean writing to the console there and then. Anything at WARNING or above is written at
+# once. The level comes from --log=<level> (debug, info, warning, error), and defaults to info.
+#
+# Nothing here imports Panda3D.
+
+import sys
+import time
+import json
+import contextlib
+import threading
+import collections
+import logging
+import logging.handlers
+
+clock = time.time
+
+#snapshots kept for export
+RING_SIZE = 120
+#seconds between the snapshots a running client or server takes
+REPORT = 5.0
+#log records held before they are written out
+LOG_BUFFER = 256
+
+#### COUNTERS AND HISTOGRAMS ####
+
+counters = collections.defaultdict(int)
+histograms = {}
+_lock = threading.Lock()
+
+# Latencies in power-of-two buckets: bucket k holds those under 2**k microseconds that
+# don't fit in bucket k - 1
+class Histogram:
+	def __init__(self):
+		self.counts = [0] * 32
+		self.n = 0
+		self.total = 0.0
+		self.max = 0.0
+
+	def record(self, seconds):
+		self.counts[min(int(seconds * 1e6).bit_length(), 31)] += 1
+		self.n += 1
+		self.total += seconds
+		if seconds > self.max:
+			self.max = seconds
+
+	# An upper bound, in seconds, on the latency that fraction p of records come in under
+	def percentile(self, p):
+		seen = 0
+		for (k, count) in enumerate(self.counts):
+			seen += count
+			if seen >= p * self.n:
+				return (1 << k) / 1e6
+		return self.max
+
+	def summary(self):
+		if not self.n:
+			return {'count': 0}
+		return {'count': self.n, 'mean': self.total / self.n, 'p50': self.percentile(0.5),
+			'p99': self.percentile(0.99), 'max': self.max}
+
+def count(name, n=1):
+	with _lock:
+		counters[name] += n
+
+def observe(name, seconds):
+	with _lock:
+		if name not in histograms:
+			histograms[name] = Histogram()
+		histograms[name].record(seconds)
+
+# Records how long the block under a "with" takes
+@contextlib.contextmanager
+def timing(name):
+	start = clock()
+	try:
+		yield
+	finally:
+		observe(name, clock() - start)
+
+# Decorator: counts calls to a function and records how long each one takes
+def timed(name):
+	def wrap(function):
+		def timedFunction(*args, **kwargs):
+			with timing(name):
+				return function(*args, **kwargs)
+		timedFunction.__name__ = function.__name__
+		timedFunction.__doc__ = function.__doc__
+		return timedFunction
+	return wrap
+
+#### SNAPSHOTS AND EXPORT ####
+
+ring = collections.deque(maxlen=RING_SIZE)
+#snapshots taken, and how many of them have been exported
+_taken = 0
+_exported = 0
+
+# Copies the current figures into the ring, and returns them
+def snapshot():
+	global _taken
+	with _lock:
+		record = {'time': clock(), 'counters': dict(counters),
+			'latency': dict((name, h.summary()) for (name, h) in histograms.items())}
+		ring.append(record)
+		_taken += 1
+	return record
+
+# Writes the snapshots taken since the last export out as JSON lines, to a file or, for a
+# URL, in the body of a POST. Snapshots that fell out of the ring in between are lost.
+# Never blocks.
+def export(target):
+	global _exported
+	with _lock:
+		fresh = min(_taken - _exported, len(ring))
+		records = list(ring)[len(ring) - fresh:]
+		_exported = _taken
+	if not records:
+		return
+	thread = threading.Thread(target=_export, args=(records, target), name='metrics export')
+	thread.daemon = True
+	thread.start()
+
+# Where to export every snapshot as it is taken, from --metrics=<file or URL>; None if not given
+def exportTarget(argv):
+	for arg in argv:
+		if arg.startswith('--metrics='):
+			return arg.split('=', 1)[1]
+	return None
+
+def _export(records, target):
+	data = ''.join(json.dumps(r) + '\n' for r in records)
+	try:
+		if target.startswith('http://') or target.startswith('https://'):
+			#urllib2 takes longer to import than the rest of the server put together
+			import urllib2
+			urllib2.urlopen(urllib2.Request(target, data, {'Content-Type': 'application/x-ndjson'}), timeout=10).close()
+		else:
+			with open(target, 'a') as f:
+				f.write(data)
+	except IOError as e:
+		log.warning("Couldn't export metrics to %s: %s", target, e)
+
+#### PROFILER ####
+
+class Profiler:
+	def __init__(self, thread=None, interval=0.005):
+		#the thread to watch; by default, the one that made the profiler
+		self.target = (thread or threading.current_thread()).ident
+		self.interval = interval
+		#samples by the innermost function, and by every function on the stack
+		self.own = collections.Counter()
+		self.inclusive = collections.Counter()
+		self.samples = 0
+		self.running = False
+
+	def start(self):
+		if self.running:
+			return
+		self.running = True
+		thread = threading.Thread(target=self.run, name='profiler')
+		thread.daemon = True
+		thread.start()
+
+	def stop(self):
+		self.running = False
+
+	def toggle(self):
+		if self.running:
+			self.stop()
+			log.info(self.report())
+		else:
+			self.start()
+
+	def run(self):
+		while self.running:
+			time.sleep(self.interval)
+			frame = sys._current_frames().get(self.target)
+			if frame is None:
+				continue
+			self.samples += 1
+			self.own[_where(frame)] += 1
+			seen = set()
+			while frame is not None:
+				where = _where(frame)
+				if where not in seen:
+					seen.add(where)
+					self.inclusive[where] += 1
+				frame = frame.f_back
+
+	def report(self, n=15):
+		lines = ["%d samples" % self.samples]
+		for (title, table) in (("self", self.own), ("inclusive", self.inclusive)):
+			lines.append("  %s:" % title)
+			for (where, hits) in table.most_common(n):
+				lines.append("  %5.1f%%  %s" % (100.0 * hits / max(self.samples, 1), where))
+		return "\n".join(lines)
+
+def _where(frame):
+	code = frame.f_code
+	return "%s:%d %s" % (code.co_filename.split('/')[-1], code.co_firstlineno, code.co_name)
+
+#### LOGGING ####
+
+log = logging.getLogger('fogofwar')
+
+def _level(argv):
+	for arg in argv:
+		if arg.startswith('--log='):
+			return getattr(logging, arg.split('=', 1)[1].upper())
+	return logging.INFO
+
+# Sends the log to stdout, or to a file, in batches
+def setupLogging(path=None):
+	target = logging.FileHandler(path) if path else logging.StreamHandler(sys.stdout)
+	target.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+	log.addHandler(logging.handlers.MemoryHandler(LOG_BUFFER, logging.WARNING, target))
+	log.setLevel(_level(sys.argv))
+
+# Writes out whatever the log is holding
+def flushLog():
+	for handler in log.handlers:
+		handler.flush()
@@ -0,0 +1,164 @@
+# Networking for the graphical client, kept off the render thread.
+# Each connection gets a reader thread and a writer thread. The reader splits the stream into
+# payloads and puts them in a thread-safe inbox; the render thread drains the whole inbox once
+# per frame and never touches a socket itself. Frames are the same as Panda3D's (see
+# protocol.py), so either end can still be an older client or the headless server.
+#
+# Heartbeats are handled here too, on the same threads. A connection that has sent nothing for
+# a while sends a PING, and PINGs from the other side are answered as soon as they are read,
+# so the round trip time doesn't include however long a frame takes to draw. An older client
+# would take a PING for a move, so none are sent until the other side has sent something other
+# than a move: a game server's START, say, or a RESUME or SNAPSHOT after a reconnection.
+
+import socket
+import threading
+import time
+import Queue
+
+import protocol
+import metrics
+
+def _daemon(target, name):
+	thread = threading.Thread(target=target, name=name)
+	thread.daemon = True
+	thread.start()
+	return thread
+
+class Connection:
+	def __init__(self, sock):
+		self.sock = sock
+		self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.address = '%s:%d' % sock.getpeername()[:2]
+		self.frames = protocol.FrameReader()
+		self.inbox = Queue.Queue()
+		self.outbox = Queue.Queue()
+		#set by the reader thread once the other side has gone away
+		self.closed = False
+		#when anything last arrived; round trip times go to metrics.py as 'rtt'
+		self.lastHeard = time.time()
+		#whether the other side has sent anything but moves, and so knows about PINGs
+		self.speaks = False
+		#whether the other side has ever answered a PING
+		self.answers = False
+
+		_daemon(self.readLoop, 'reader %s' % self.address)
+		_daemon(self.writeLoop, 'writer %s' % self.address)
+
+	def readLoop(self):
+		while True:
+			try:
+				data = self.sock.recv(4096)
+			except socket.error:
+				data = ''
+			if not data:
+				self.closed = True
+				return
+			self.lastHeard = time.time()
+			for payload in self.frames.feed(data):
+				kind = protocol.messageType(payload)
+				if kind is not None:
+					self.speaks = True
+				if kind == protocol.PING:
+					self.outbox.put(protocol.encodePong(protocol.decodeStamp(payload)))
+				elif kind == protocol.PONG:
+					metrics.observe('rtt', self.lastHeard - protocol.decodeStamp(payload))
+					self.answers = True
+				else:
+					self.inbox.put(payload)
+
+	def writeLoop(self):
+		while True:
+			try:
+				payload = self.outbox.get(timeout=protocol.HEARTBEAT)
+			except Queue.Empty:
+				if not self.speaks:
+					continue
+				payload = protocol.encodePing(time.time())
+			if payload is None:
+				return
+			try:
+				self.sock.sendall(protocol.frame(payload))
+			except socket.error:
+				self.closed = True
+				return
+
+	# Queues a payload for sending; never blocks
+	def send(self, payload):
+		self.outbox.put(payload)
+
+	# Whether the other side has gone quiet for too long, though it used to answer PINGs
+	def silent(self):
+		return self.answers and time.time() - self.lastHeard > protocol.SILENCE
+
+	# Every payload that has arrived since the last call, oldest first; never blocks
+	def receiveAll(self):
+		payloads = []
+		try:
+			while True:
+				payloads.append(self.inbox.get_nowait())
+		except Queue.Empty:
+			return payloads
+
+	def close(self):
+		self.outbox.put(None)
+		try:
+			self.sock.shutdown(socket.SHUT_RDWR)
+		except socket.error:
+			pass
+		self.sock.close()
+
+# Accepts connections on a background thread
+class Listener:
+	def __init__(self, port, backlog):
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.sock.bind(('', port))
+		self.sock.listen(backlog)
+		self.accepted = Queue.Queue()
+
+		_daemon(self.acceptLoop, 'listener %d' % port)
+
+	def acceptLoop(self):
+		while True:
+			try:
+				sock, addr = self.sock.accept()
+			except socket.error:
+				return
+			self.accepted.put(Connection(sock))
+
+	# The connections accepted since the last call; never blocks
+	def poll(self):
+		connections = []
+		try:
+			while True:
+				connections.append(self.accepted.get_nowait())
+		except Queue.Empty:
+			return connections
+
+	def close(self):
+		self.sock.close()
+
+# Opens a connection on a background thread
+class Connector:
+	def __init__(self, host, port, timeout):
+		self.host = host
+		self.port = port
+		self.timeout = timeout
+		self.result = Queue.Queue()
+
+		_daemon(self.connect, 'connector %s:%d' % (host, port))
+
+	def connect(self):
+		try:
+			sock = socket.create_connection((self.host, self.port), self.timeout)
+			sock.settimeout(None)
+			self.result.put(Connection(sock))
+		except socket.error:
+			self.result.put(False)
+
+	# None while still connecting, then a Connection, or False if it failed
+	def poll(self):
+		try:
+			return self.result.get_nowait()
+		except Queue.Empty:
+			return None
@@ -0,0 +1,315 @@
+# Correctness and speed benchmarks for the rules, run headless.
+# Perft counts the leaves of the legal move tree to a fixed depth; any mistake in move
+# generation or check detection changes the count. "Fog" counts add up, over the same leaves,
+# how many squares the side to move can see, which catches mistakes in visibility.
+# The speed figures are compared against perft_baseline.json to catch regressions. Each
+# benchmark starts with an empty position cache (see chesscore.CACHE), so what ran before it
+# can't make it look faster.
+#
+# Usage: python perft.py [--quick] [--verify] [--save]
+#   --quick   skip the deepest searches
+#   --verify  also check the counts against a slow, independent move generator, and
+#             batch.py's NumPy masks against the board's own
+#   --save    record this machine's speeds as the new baseline
+
+import sys
+import os
+import time
+import json
+import random
+
+import chesscore
+from chesscore import Board, WHITE, BLACK, opponent, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
+from visibility import VisibilityMap
+from bitboard import popcount
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'perft_baseline.json')
+
+#how much slower than the baseline we can be before calling it a regression
+TOLERANCE = 0.15
+
+#name, FEN, then (depth, nodes, fog) for each depth we check. This game has no castling,
+#en passant or promotion, so only the start position matches the usual published counts.
+POSITIONS = [
+	("start", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w",
+		[(1, 20, 640), (2, 400, 13876), (3, 8902, 308598), (4, 197281, 7254119)]),
+	("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w",
+		[(1, 46, 2185), (2, 1865, 86081), (3, 86585, 4113957)]),
+	("endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w",
+		[(1, 14, 318), (2, 191, 4501), (3, 2810, 67603), (4, 43087, 1054355)]),
+	("pins", "4k3/4r3/8/1b6/8/3N1P2/4B3/r3K2R w",
+		[(1, 3, 97), (2, 104, 2967), (3, 2232, 68689)]),
+	#blocked pawns that can still see past the pieces in front of them
+	("scouts", "4k3/pp3ppp/8/2pPp3/2P1P3/8/PP3PPP/4K3 w",
+		[(1, 15, 465), (2, 211, 7081), (3, 3208, 100620), (4, 44582, 1507243)]),
+	#most of each side's army hidden from the other
+	("fog", "r1b1k2r/ppq2ppp/2n1pn2/3p4/1bPP4/2NBPN2/PP3PPP/R1BQK2R w",
+		[(1, 35, 1499), (2, 1632, 69074), (3, 58637, 2509064)]),
+]
+
+#### COUNTING ####
+
+def perft(board, depth):
+	moves = board.legalMoves()
+	if depth == 1:
+		return len(moves)
+	nodes = 0
+	for (fr, to) in moves:
+		board.makeMove(fr, to)
+		nodes += perft(board, depth - 1)
+		board.unmakeMove()
+	return nodes
+
+def fogPerft(board, depth):
+	if depth == 0:
+		return popcount(board.visibleMask(board.turn))
+	total = 0
+	for (fr, to) in board.legalMoves():
+		board.makeMove(fr, to)
+		total += fogPerft(board, depth - 1)
+		board.unmakeMove()
+	return total
+
+# The same count from nothing of the engine's but the pieces' colors and kinds. The board is
+# a plain list of 64 squares, every piece walks its moves a square at a time, and a move is
+# thrown out if it leaves the mover's king where an enemy piece could walk onto it.
+def slowPerft(board, depth):
+	squares = [(p.color, p.kind) if p else None for p in board.pieces]
+	return _slowPerft(squares, board.turn, depth)
+
+def _slowPerft(squares, turn, depth):
+	if depth == 0:
+		return 1
+	nodes = 0
+	for (fr, to) in _walkMoves(squares, turn):
+		after = list(squares)
+		after[to] = after[fr]
+		after[fr] = None
+		if not _attacked(after, after.index((turn, KING)), opponent[turn]):
+			nodes += _slowPerft(after, opponent[turn], depth - 1)
+	return nodes
+
+KNIGHT_STEPS = [(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)]
+KING_STEPS = [(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)]
+RAYS = {BISHOP: KING_STEPS[1::2], ROOK: KING_STEPS[0::2], QUEEN: KING_STEPS}
+
+def _on(x, y):
+	return 0 <= x < 8 and 0 <= y < 8
+
+# Every (from, to) pair of square indices side "color" could move between, check aside
+def _walkMoves(squares, color):
+	moves = []
+	for i in xrange(64):
+		if not squares[i] or squares[i][0] != color:
+			continue
+		kind = squares[i][1]
+		x, y = i & 7, i >> 3
+		if kind == PAWN:
+			dy = 1 if color == WHITE else -1
+			if _on(x, y + dy) and not squares[i + 8*dy]:
+				moves.append((i, i + 8*dy))
+				if y == (1 if color == WHITE else 6) and not squares[i + 16*dy]:
+					moves.append((i, i + 16*dy))
+			for dx in (-1, 1):
+				if _on(x + dx, y + dy):
+					target = squares[i + dx + 8*dy]
+					if target and target[0] != color:
+						moves.append((i, i + dx + 8*dy))
+		elif kind in (KNIGHT, KING):
+			for (dx, dy) in (KNIGHT_STEPS if kind == KNIGHT else KING_STEPS):
+				if _on(x + dx, y + dy):
+					target = squares[i + dx + 8*dy]
+					if not target or target[0] != color:
+						moves.append((i, i + dx + 8*dy))
+		else:
+			for (dx, dy) in RAYS[kind]:
+				tx, ty = x + dx, y + dy
+				while _on(tx, ty):
+					target = squares[tx + 8*ty]
+					if not target or target[0] != color:
+						moves.append((i, tx + 8*ty))
+					if target:
+						break
+					tx, ty = tx + dx, ty + dy
+	return moves
+
+# Whether a piece of side "by" could move onto square index i, looking outwards from it
+def _attacked(squares, i, by):
+	x, y = i & 7, i >> 3
+	def at(tx, ty):
+		return squares[tx + 8*ty] if _on(tx, ty) else None
+	if any(at(x + dx, y + dy) == (by, KNIGHT) for (dx, dy) in KNIGHT_STEPS):
+		return True
+	if any(at(x + dx, y + dy) == (by, KING) for (dx, dy) in KING_STEPS):
+		return True
+	#a pawn takes towards the far side, so it attacks from one rank nearer its own
+	dy = -1 if by == WHITE else 1
+	if at(x - 1, y + dy) == (by, PAWN) or at(x + 1, y + dy) == (by, PAWN):
+		return True
+	for (dx, dy) in KING_STEPS:
+		sliders = (ROOK, QUEEN) if not dx or not dy else (BISHOP, QUEEN)
+		tx, ty = x + dx, y + dy
+		while _on(tx, ty):
+			target = squares[tx + 8*ty]
+			if target:
+				if target[0] == by and target[1] in sliders:
+					return True
+				break
+			tx, ty = tx + dx, ty + dy
+	return False
+
+def checkCounts(quick, verify):
+	ok = True
+	for (name, fen, expected) in POSITIONS:
+		passed = True
+		for (depth, nodes, fog) in expected:
+			if quick and nodes > 10000:
+				continue
+			board = Board()
+			board.setupFEN(fen)
+			results = [('nodes', perft(board, depth), nodes), ('fog', fogPerft(board, depth), fog)]
+			if verify:
+				results.append(('slow', slowPerft(board, depth), nodes))
+			for (what, got, want) in results:
+				if got != want:
+					print "FAIL %s depth %d %s: got %d, expected %d" % (name, depth, what, got, want)
+					passed = False
+		print "%-10s %s" % (name, "ok" if passed else "FAILED")
+		ok = ok and passed
+	return ok
+
+# batch.py's visibility and attack masks against Board's, for both sides, in the test
+# positions and every position of some random games
+def checkBatch(games):
+	try:
+		import batch
+	except ImportError:
+		print "%-10s skipped, no NumPy" % "batch"
+		return True
+	boards = []
+	for (name, fen, expected) in POSITIONS:
+		board = Board()
+		board.setupFEN(fen)
+		boards.append(board)
+	codes = [batch.encode(board) for board in boards]
+	wanted = [[(b.visibleMask(c), b.attackMask(c, b.occupiedAll())) for c in (WHITE, BLACK)] for b in boards]
+	for moves in games:
+		board = Board()
+		board.setup()
+		for (fr, to) in moves:
+			board.makeMove(fr, to)
+			codes.append(batch.encode(board))
+			wanted.append([(board.visibleMask(c), board.attackMask(c, board.occupiedAll())) for c in (WHITE, BLACK)])
+
+	passed = True
+	for color in (WHITE, BLACK):
+		visible = batch.visibleMasks(codes, color)
+		attacks = batch.attackMasks(codes, color)
+		for n in xrange(len(codes)):
+			if (int(visible[n]), int(attacks[n])) != wanted[n][color]:
+				print "FAIL batch position %d, side %d: got %x/%x, expected %x/%x" % ((n, color, visible[n], attacks[n]) + wanted[n][color])
+				passed = False
+	print "%-10s %s" % ("batch", "ok (%d positions)" % len(codes) if passed else "FAILED")
+	return passed
+
+#### SPEED ####
+
+# A fixed set of games of random legal moves to replay
+def randomGames(count, plies):
+	rand = random.Random(1)
+	games = []
+	for g in xrange(count):
+		board = Board()
+		board.setup()
+		moves = []
+		for ply in xrange(plies):
+			legal = board.legalMoves()
+			if not legal:
+				break
+			move = rand.choice(sorted(legal))
+			board.makeMove(*move)
+			moves.append(move)
+		games.append(moves)
+	return games
+
+def benchNodes(quick):
+	nodes = 0
+	start = time.time()
+	for (name, fen, expected) in POSITIONS:
+		board = Board()
+		board.setupFEN(fen)
+		depth = 2 if quick else 3
+		nodes += perft(board, depth)
+	return nodes / (time.time() - start)
+
+def benchVisibility(games):
+	updates = 0
+	elapsed = 0.0
+	for moves in games:
+		board = Board()
+		board.setup()
+		maps = [VisibilityMap(board, WHITE), VisibilityMap(board, BLACK)]
+		for (fr, to) in moves:
+			board.makeMove(fr, to)
+			start = time.time()
+			maps[WHITE].update(fr, to)
+			maps[BLACK].update(fr, to)
+			elapsed += time.time() - start
+			updates += 2
+	return updates / elapsed
+
+def benchCheck(games, repeat=20):
+	tests = 0
+	elapsed = 0.0
+	for moves in games:
+		board = Board()
+		board.setup()
+		for (fr, to) in moves:
+			board.makeMove(fr, to)
+			start = time.time()
+			for i in xrange(repeat):
+				board.inCheck(WHITE)
+				board.inCheck(BLACK)
+			elapsed += time.time() - start
+			tests += 2 * repeat
+	return tests / elapsed
+
+def benchmark(quick, save):
+	games = randomGames(10 if quick else 40, 100)
+	speeds = {}
+	for (name, bench, arg) in [('nodes/sec', benchNodes, quick),
+			('visibility updates/sec', benchVisibility, games), ('check tests/sec', benchCheck, games)]:
+		chesscore.CACHE.clear()
+		speeds[name] = bench(arg)
+
+	#quick and full runs measure different mixes of positions, so each has its own baseline
+	mode = 'quick' if quick else 'full'
+	baselines = {}
+	if os.path.exists(BASELINE):
+		baselines = json.load(open(BASELINE))
+	baseline = baselines.get(mode, {})
+
+	ok = True
+	for name in sorted(speeds):
+		line = "%-24s %12.0f" % (name, speeds[name])
+		if name in baseline:
+			change = speeds[name] / baseline[name] - 1
+			line += "   %+6.1f%% vs baseline" % (change * 100)
+			if change < -TOLERANCE:
+				line += "   REGRESSION"
+				ok = False
+		print line
+
+	if save:
+		baselines[mode] = speeds
+		json.dump(baselines, open(BASELINE, 'w'), indent=1, sort_keys=True)
+		print "Saved %s baseline to %s" % (mode, BASELINE)
+	return ok
+
+if __name__ == '__main__':
+	quick = '--quick' in sys.argv
+	counted = checkCounts(quick, '--verify' in sys.argv)
+	if '--verify' in sys.argv:
+		counted = checkBatch(randomGames(10, 100)) and counted
+	fast = benchmark(quick, '--save' in sys.argv)
+	sys.exit(0 if counted and fast else 1)
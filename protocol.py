@@ -0,0 +1,177 @@
+# The wire format shared by the client and the headless server.
+# Every message travels in a Panda3D-style TCP frame: a little-endian 16-bit length followed
+# by the payload, so a server written with plain sockets can talk to ConnectionWriter and
+# QueuedConnectionReader. The original message is a move: four bytes, (fromX, fromY, toX, toY).
+# Coordinates are always below 8, so any other message starts with a type byte >= 8.
+
+import struct
+
+PORT = 15905 # Chosen by fair dice roll.
+             # Guaranteed to be random.
+#spectators connect here (see broadcast.py)
+SPECTATOR_PORT = PORT + 1
+
+#message types
+START = 0x10
+FOG = 0x11
+REJECT = 0x12
+SUBSCRIBE = 0x13
+PING = 0x14
+PONG = 0x15
+SNAPSHOT = 0x16
+RESUME = 0x17
+REQUEUE = 0x18
+ABANDONED = 0x19
+
+#in a FOG message, the code for a square that has gone out of sight
+HIDDEN = 0xFF
+
+#seconds a connection may go without sending anything before it sends a PING
+HEARTBEAT = 2.0
+#seconds without hearing anything before a peer that answers PINGs is taken to be gone
+SILENCE = 10.0
+
+def frame(payload):
+	return struct.pack('<H', len(payload)) + payload
+
+# Splits a byte stream back into payloads, however it happens to be chunked
+class FrameReader:
+	def __init__(self):
+		self.buffer = ''
+
+	# Adds received bytes and returns the list of payloads they completed
+	def feed(self, data):
+		self.buffer += data
+		payloads = []
+		while len(self.buffer) >= 2:
+			(length,) = struct.unpack_from('<H', self.buffer)
+			if len(self.buffer) < 2 + length:
+				break
+			payloads.append(self.buffer[2:2+length])
+			self.buffer = self.buffer[2+length:]
+		return payloads
+
+def messageType(payload):
+	kind = ord(payload[0])
+	return None if kind < 8 else kind
+
+#### MOVES ####
+
+def encodeMove(fr, to):
+	return struct.pack('BBBB', fr[0], fr[1], to[0], to[1])
+
+def decodeMove(payload):
+	fx, fy, tx, ty = struct.unpack('BBBB', payload[:4])
+	return (fx, fy), (tx, ty)
+
+#### GAME START ####
+
+# Sent by the server to each player of a new game: which side they play, the game's id, and a
+# key that lets them take their seat back with RESUME if they lose their connection. Older
+# servers don't send the key.
+def encodeStart(color, gameId, key):
+	return struct.pack('<BBII', START, color, gameId, key)
+
+def decodeStart(payload):
+	kind, color, gameId = struct.unpack_from('<BBI', payload)
+	key = struct.unpack_from('<I', payload, 6)[0] if len(payload) >= 10 else 0
+	return color, gameId, key
+
+#### FOG ####
+
+# Sent by an authoritative server (see server.py) to each player after every move, instead of
+# the move itself: whose turn it is, the status flags of the side to move (see gamerecord),
+# and every square whose contents the player can now see differently. Each square is two
+# bytes, its index and its piece code (see chesscore.pieceCode), or HIDDEN if it has just
+# gone out of sight.
+def encodeFog(turn, flags, changes):
+	entries = ''.join(struct.pack('BB', x + 8*y, HIDDEN if code is None else code) for ((x, y), code) in changes)
+	return struct.pack('BBB', FOG, turn, flags) + entries
+
+# Returns (turn, flags, [((x, y), code or None), ...])
+def decodeFog(payload):
+	kind, turn, flags = struct.unpack_from('BBB', payload)
+	changes = []
+	for offset in xrange(3, len(payload) - 1, 2):
+		i, code = struct.unpack_from('BB', payload, offset)
+		changes.append(((i & 7, i >> 3), None if code == HIDDEN else code))
+	return turn, flags, changes
+
+# Sent back to a player whose move an authoritative server refused
+def encodeReject(fr, to):
+	return struct.pack('B', REJECT) + encodeMove(fr, to)
+
+def decodeReject(payload):
+	return decodeMove(payload[1:])
+
+#### SPECTATORS ####
+
+#the view of a spectator who sees the whole board; otherwise they see what WHITE or BLACK sees
+EVERYTHING = 2
+
+# Sent by a spectator to start watching a game. From then on it gets the same FOG messages as
+# a player with that view would.
+def encodeSubscribe(gameId, view):
+	return struct.pack('<BIB', SUBSCRIBE, gameId, view)
+
+def decodeSubscribe(payload):
+	kind, gameId, view = struct.unpack('<BIB', payload)
+	return gameId, view
+
+#### HEARTBEATS ####
+
+# Either side may send a PING with the time it was sent; the other answers straight away with
+# a PONG carrying the same time, which gives the round trip time. An older peer would take a
+# PING for a move, so none is sent until the other side has sent something other than a move
+# itself. Silence is only held against a peer that has answered a PING.
+def encodePing(sent):
+	return struct.pack('<Bd', PING, sent)
+
+def encodePong(sent):
+	return struct.pack('<Bd', PONG, sent)
+
+# The time carried by a PING or PONG
+def decodeStamp(payload):
+	return struct.unpack('<Bd', payload)[1]
+
+#### RESYNCING ####
+
+# Sent by a player who has lost their connection and made a new one. Game 0 is a game with
+# the other player directly rather than through a server.
+def encodeResume(gameId, key):
+	return struct.pack('<BII', RESUME, gameId, key)
+
+def decodeResume(payload):
+	kind, gameId, key = struct.unpack('<BII', payload)
+	return gameId, key
+
+# Sent by a server to a player whose game it has called off before the first move, because the
+# other player turned out to be getting back into a game of their own. The player is waiting
+# for an opponent again, and will get a new START.
+def encodeRequeue():
+	return struct.pack('B', REQUEUE)
+
+# Sent by a server to a player whose opponent lost their connection and didn't come back in
+# time. The game is over, and the server closes the connection after it.
+def encodeAbandoned():
+	return struct.pack('B', ABANDONED)
+
+#in a SNAPSHOT, a square the player can't see
+UNSEEN = 0xF
+
+# The answer to RESUME: the whole position as the player may see it, in 40 bytes. After the
+# game id, the side to move and the number of moves made, each square's piece code (see
+# chesscore.pieceCode) takes four bits, or UNSEEN.
+def encodeSnapshot(gameId, turn, ply, codes):
+	nibbles = [UNSEEN if code is None else code for code in codes]
+	packed = ''.join(chr(nibbles[i] | nibbles[i+1] << 4) for i in xrange(0, 64, 2))
+	return struct.pack('<BIBH', SNAPSHOT, gameId, turn, ply) + packed
+
+# Returns (gameId, turn, ply, [code or None for each square index])
+def decodeSnapshot(payload):
+	kind, gameId, turn, ply = struct.unpack_from('<BIBH', payload)
+	codes = []
+	for byte in payload[8:40]:
+		for nibble in (ord(byte) & 0xF, ord(byte) >> 4):
+			codes.append(None if nibble == UNSEEN else nibble)
+	return gameId, turn, ply, codes
@@ -0,0 +1,169 @@
+# Render quality that follows the frame rate.
+# A Governor is told how long every frame took. It keeps a histogram of frame times and looks
+# at the median of the last SAMPLE frames. When the median is well over the frame budget it
+# drops a tier straight away. When the median has been well under budget for a while it tries
+# the tier above. Each time a tier it raised to turns out too slow, it waits twice as long
+# before trying again, so it settles instead of flickering between two tiers.
+#
+# A tier decides the shadows, how many lights there are, how long squares take to fade in and
+# out of the fog, antialiasing, and how long a piece takes to move. Antialiasing only shows
+# where the window got a multisample framebuffer ("framebuffer-multisample 1" in Config.prc).
+#
+# Run with --quality=<tier> to pin a tier and turn the governor off.
+
+import sys
+import bisect
+import collections
+
+from panda3d.core import PointLight, Spotlight, PerspectiveLens, AntialiasAttrib, Vec4
+from direct.task.Task import Task
+
+from metrics import log
+
+class Tier:
+	def __init__(self, name, shadows, lights, fade, antialias, animation):
+		self.name = name
+		self.shadows = shadows
+		#how many of the scene's lights are on, most important first
+		self.lights = lights
+		#seconds for a square to fade in or out, and for a piece to move
+		self.fade = fade
+		self.antialias = antialias
+		self.animation = animation
+
+TIERS = [
+	Tier('low', shadows=False, lights=1, fade=0.0, antialias=False, animation=0.3),
+	Tier('medium', shadows=False, lights=2, fade=0.5, antialias=False, animation=0.6),
+	Tier('high', shadows=False, lights=2, fade=1.0, antialias=True, animation=1.0),
+	Tier('ultra', shadows=True, lights=3, fade=1.0, antialias=True, animation=1.0),
+]
+#how the game has always looked
+DEFAULT = 2
+
+#upper edges of the histogram's buckets, in milliseconds; the last bucket is everything slower
+BUCKETS = [5, 10, 17, 25, 33, 50, 67, 100, 200]
+
+#frames the median is taken over
+SAMPLE = 60
+#a median this far over the frame budget drops a tier, and one this far under may raise it
+SLOW = 1.2
+FAST = 0.7
+#seconds of fast frames before trying the tier above, to start with
+PATIENCE = 5.0
+
+# Decides the tier from frame times; knows nothing about rendering
+class Governor:
+	def __init__(self, fps=60, tier=DEFAULT):
+		self.budget = 1.0 / fps
+		self.tier = tier
+		self.recent = collections.deque(maxlen=SAMPLE)
+		self.counts = [0] * (len(BUCKETS) + 1)
+		self.frames = 0
+		#seconds of fast frames in a row, and how many are needed before raising the tier
+		self.fastFor = 0.0
+		self.patience = PATIENCE
+		#the last tier we raised to, until it has proved itself
+		self.trying = None
+
+	# Call once a frame with how long it took; returns the new tier if it changed, else None
+	def frame(self, dt):
+		self.frames += 1
+		self.counts[bisect.bisect_left(BUCKETS, dt * 1000)] += 1
+		self.recent.append(dt)
+		if len(self.recent) < SAMPLE:
+			return None
+		median = sorted(self.recent)[SAMPLE // 2]
+		if median > self.budget * SLOW and self.tier > 0:
+			if self.trying == self.tier:
+				self.patience *= 2
+			return self.change(self.tier - 1)
+		if median < self.budget * FAST and self.tier < len(TIERS) - 1:
+			self.fastFor += dt
+			if self.fastFor >= self.patience:
+				self.trying = self.tier + 1
+				return self.change(self.tier + 1)
+		else:
+			self.fastFor = 0.0
+		return None
+
+	def change(self, tier):
+		self.tier = tier
+		#judge the new tier on its own frames
+		self.recent.clear()
+		self.fastFor = 0.0
+		return tier
+
+	# The histogram as [(upper edge in ms, or None for the last bucket, frames), ...]
+	def histogram(self):
+		return zip(BUCKETS + [None], self.counts)
+
+	def report(self):
+		lines = ["Quality %s, %d frames" % (TIERS[self.tier].name, self.frames)]
+		low = 0
+		for (high, count) in self.histogram():
+			label = "%3d-%3dms" % (low, high) if high else "%3dms+   " % low
+			share = float(count) / self.frames if self.frames else 0.0
+			lines.append("  %s %6d %s" % (label, count, '#' * int(share * 50)))
+			low = high
+		return "\n".join(lines)
+
+# The tier given with --quality=<name>, if any
+def pinnedTier(argv):
+	for arg in argv:
+		if arg.startswith('--quality='):
+			names = [t.name for t in TIERS]
+			return names.index(arg.split('=', 1)[1])
+	return None
+
+# Applies the governor's tier to the scene. "lights" are the scene's own light nodes, most
+# important first; the tiers that want more get a fill light and a shadow-casting spotlight
+# from here.
+class Quality:
+	def __init__(self, lights, fps=60):
+		pinned = pinnedTier(sys.argv)
+		self.governor = Governor(fps, DEFAULT if pinned is None else pinned)
+		self.lights = list(lights)
+
+		fill = PointLight("fillLight")
+		fill.setColor(Vec4(.2, .2, .2, 1))
+		self.lights.append(render.attachNewNode(fill))
+		self.lights[-1].setPos(0, 0, 10)
+
+		spot = Spotlight("shadowLight")
+		spot.setLens(PerspectiveLens())
+		spot.setColor(Vec4(.3, .3, .3, 1))
+		spot.setShadowCaster(True)
+		self.spot = render.attachNewNode(spot)
+		self.spot.setPos(-6, -6, 12)
+		self.spot.lookAt(0, 0, 0)
+
+		self.apply()
+		if pinned is None:
+			taskMgr.add(self.tskGovern, "Govern render quality")
+
+	def tier(self):
+		return TIERS[self.governor.tier]
+
+	def tskGovern(self, task):
+		if self.governor.frame(globalClock.getDt()) is not None:
+			log.info("Render quality: %s", self.tier().name)
+			self.apply()
+		return Task.cont
+
+	def apply(self):
+		tier = self.tier()
+		for (n, light) in enumerate(self.lights):
+			if n < tier.lights:
+				render.setLight(light)
+			else:
+				render.clearLight(light)
+		if tier.shadows:
+			render.setLight(self.spot)
+			render.setShaderAuto()
+		else:
+			render.clearLight(self.spot)
+			render.clearShader()
+		if tier.antialias:
+			render.setAntialias(AntialiasAttrib.MAuto)
+		else:
+			render.clearAntialias()
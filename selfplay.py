@@ -0,0 +1,77 @@
+# Headless self-play: plays many games through the rules engine, in parallel, and streams
+# them to a game archive (see gamerecord.py). Each game is played start to finish inside
+# one worker process and comes back already encoded, so the only traffic between processes
+# is the game's records.
+#
+# Usage: python selfplay.py [-n GAMES] [-j WORKERS] [--plies N] [--engine white|black|both]
+#                           [--budget SECONDS] [--seed N] [-o FILE]
+
+import sys
+import time
+import random
+import argparse
+import multiprocessing
+
+from chesscore import Board, WHITE, BLACK
+from engine import Engine
+from gamerecord import ArchiveWriter, GameEncoder, resultOf, RESULTS
+
+#### PLAYING ####
+
+# Plays one game and returns its records, its length and its result
+def playGame(seed, plies, engines, budget):
+	rand = random.Random(seed)
+	board = Board()
+	board.setup()
+	players = dict((color, Engine(color, board, budget)) for color in engines)
+	encoder = GameEncoder(board)
+	records = [encoder.header]
+	for ply in xrange(plies):
+		legal = board.legalMoves()
+		if not legal:
+			break
+		player = players.get(board.turn)
+		fr, to = player.chooseMove(board) if player else rand.choice(legal)
+		captured = board.makeMove(fr, to)
+		records.append(encoder.encodePly(fr, to, captured, board))
+		for p in players.itervalues():
+			p.observe(board)
+	return ''.join(records), encoder.plies, resultOf(board)
+
+#### DRIVER ####
+
+# Worker entry point; takes one argument so it can go through Pool.imap_unordered
+def _work((seed, plies, engines, budget)):
+	return playGame(seed, plies, engines, budget)
+
+def main(argv):
+	parser = argparse.ArgumentParser(description="Play fog of war chess games against itself.")
+	parser.add_argument('-n', '--games', type=int, default=1000)
+	parser.add_argument('-j', '--workers', type=int, default=multiprocessing.cpu_count())
+	parser.add_argument('--plies', type=int, default=300, help="stop unfinished games after this many moves")
+	parser.add_argument('--engine', choices=['white', 'black', 'both'], help="let engine.py play a side; otherwise moves are random")
+	parser.add_argument('--budget', type=float, default=0.1, help="engine seconds per move")
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('-o', '--output', default='selfplay.fowr', help="game archive to add the games to")
+	args = parser.parse_args(argv)
+
+	engines = {None: [], 'white': [WHITE], 'black': [BLACK], 'both': [WHITE, BLACK]}[args.engine]
+	jobs = [(args.seed + g, args.plies, engines, args.budget) for g in xrange(args.games)]
+
+	counts = [0] * len(RESULTS)
+	start = time.time()
+	archive = ArchiveWriter(args.output)
+	pool = multiprocessing.Pool(args.workers)
+	for (records, plies, result) in pool.imap_unordered(_work, jobs, chunksize=8):
+		archive.append(records, plies, result)
+		counts[result] += 1
+	pool.close()
+	pool.join()
+	archive.close()
+
+	elapsed = time.time() - start
+	print "%d games in %.1fs on %d workers (%.0f games/min)" % (args.games, elapsed, args.workers, args.games * 60 / elapsed)
+	print ", ".join("%s %d" % (RESULTS[r], counts[r]) for r in xrange(len(RESULTS)))
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
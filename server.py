@@ -0,0 +1,375 @@
+# Headless game server: hosts many independent matches in one process and one event loop.
+# Players connect with the ordinary client. Connections are paired as they arrive; each pair
+# gets its own authoritative Board, and the usual 4-byte move datagrams are checked against
+# that board and relayed to the other player of the same game. Every game is recorded in a
+# game archive (see gamerecord.py).
+#
+# With --authoritative, players are never sent each other's moves. After every move each
+# player gets a FOG message instead, listing only the squares that came into or went out of
+# their sight, or changed within it. A client therefore never holds pieces it can't see.
+# Illegal moves are refused with a REJECT message.
+#
+# Spectators connect to the next port up and watch any game by its id (see broadcast.py). With
+# --authoritative they see nothing of a game until it is over, so that a player can't watch
+# their own game as a spectator to see through the fog.
+#
+# Players who have shown they know about heartbeats are sent a PING whenever their connection
+# has been quiet for a while. One who drops out, or stops answering, keeps their seat for GRACE
+# seconds. If they connect again and send RESUME with the key they were given at the start,
+# they get a SNAPSHOT of the game as they may see it and carry on. A new connection isn't
+# paired until it has had ARRIVAL seconds to send a RESUME, so one coming back to its game
+# isn't put in a new one first.
+#
+# The server times sending, receiving and its own housekeeping (see metrics.py), and takes a
+# snapshot of the figures every metrics.REPORT seconds. With --metrics=<file or URL> each one
+# is exported as it is taken.
+#
+# Usage: python server.py [port] [archive] [--authoritative] [--metrics=<file or URL>] [--log=<level>]
+
+import asyncore
+import socket
+import signal
+import sys
+import time
+import random
+import itertools
+
+import protocol
+import gamerecord
+import broadcast
+import metrics
+from metrics import log
+from chesscore import Board, WHITE, BLACK, opponent, pieceCode
+from visibility import View
+
+#seconds a player who has lost their connection keeps their seat
+GRACE = 60.0
+#seconds a new connection has to send RESUME before it is paired; a returning client sends it
+#as soon as it connects
+ARRIVAL = 1.0
+
+#seat keys are secrets, so they mustn't be predictable from the ones handed out before them
+keys = random.SystemRandom()
+
+class Game:
+	def __init__(self, gameId, white, black, archive, authoritative=False):
+		self.id = gameId
+		self.board = Board()
+		self.board.setup()
+		self.players = {WHITE: white, BLACK: black}
+		self.over = False
+		#games are recorded from their first move, so that games abandoned straight away leave nothing behind
+		self.archive = archive
+		self.record = None
+		#what a player needs to take their seat back, and when the seats of players who have
+		#lost their connection are given up
+		self.keys = dict((color, keys.getrandbits(32)) for color in self.players)
+		self.gone = {}
+		#what each player has been shown, when players only get to see what they can see
+		self.views = dict((color, View(color)) for color in self.players) if authoritative else None
+		self.broadcast = broadcast.Broadcast(self.board, live=not authoritative)
+
+		for color, player in self.players.items():
+			player.game = self
+			player.color = color
+			player.sendMessage(protocol.encodeStart(color, gameId, self.keys[color]))
+		self.sendFog()
+
+	# Tells each player what has changed in their view of the board
+	def sendFog(self):
+		if not self.views:
+			return
+		flags = gamerecord.statusFlags(self.board)
+		for color, player in self.players.items():
+			player.sendMessage(protocol.encodeFog(self.board.turn, flags, self.views[color].update(self.board)))
+
+	def receiveMove(self, player, fr, to):
+		if self.over or player.color != self.board.turn or not self.board.isLegalMove(fr, to):
+			log.info("Game %d: rejected move %s -> %s", self.id, fr, to)
+			if self.views:
+				player.sendMessage(protocol.encodeReject(fr, to))
+			return
+		if not self.record:
+			self.record = self.archive.begin(self.board)
+		captured = self.board.makeMove(fr, to)
+		self.record.ply(fr, to, captured, self.board)
+		if self.views:
+			self.sendFog()
+		else:
+			self.players[opponent[player.color]].sendMessage(protocol.encodeMove(fr, to))
+		self.broadcast.publish(fr, to)
+		if not self.board.hasLegalMoves():
+			self.over = True
+			self.record.finish(gamerecord.resultOf(self.board))
+			self.broadcast.end()
+
+	# Holds a player's seat for them; returns True if the game is over
+	def disconnected(self, player):
+		self.gone[player.color] = time.time() + GRACE
+		if self.over or len(self.gone) == len(self.players):
+			self.abandon()
+			return True
+		return False
+
+	# Ends the game for good. Anyone still playing it is told their opponent has left, unless
+	# the game was already over on the board.
+	def abandon(self):
+		ended = self.over
+		self.over = True
+		if self.record:
+			self.record.finish(gamerecord.UNFINISHED)
+		self.broadcast.end()
+		for color, player in self.players.items():
+			if color not in self.gone:
+				player.game = None
+				if ended:
+					player.close()
+				else:
+					player.sendLast(protocol.encodeAbandoned())
+
+	# Whether a seat has been held for longer than GRACE
+	def expired(self, now):
+		return any(now > deadline for deadline in self.gone.itervalues())
+
+	# The side a RESUME key belongs to, or None
+	def seat(self, key):
+		for color, k in self.keys.items():
+			if k == key:
+				return color
+		return None
+
+	# Gives a player their seat back on a new connection, and tells them where the game has got to
+	def resume(self, player, color):
+		old = self.players[color]
+		if old is not player and old.connected:
+			#the old connection hasn't noticed it is dead yet
+			old.game = None
+			old.close()
+		self.gone.pop(color, None)
+		self.players[color] = player
+		player.game = self
+		player.color = color
+		player.sendMessage(self.snapshot(color))
+
+	def snapshot(self, color):
+		if self.views:
+			#start the player's view afresh; the snapshot takes the place of every update so far
+			self.views[color] = View(color)
+			self.views[color].update(self.board)
+			codes = self.views[color].shown
+		else:
+			codes = [pieceCode(p) for p in self.board.pieces]
+		return protocol.encodeSnapshot(self.id, self.board.turn, len(self.board.history), codes)
+
+class PlayerConnection(asyncore.dispatcher):
+	def __init__(self, server, sock, addr):
+		asyncore.dispatcher.__init__(self, sock)
+		self.server = server
+		self.addr = addr
+		self.frames = protocol.FrameReader()
+		self.outgoing = ''
+		self.game = None
+		self.color = None
+		#when it connected
+		self.arrived = time.time()
+		#heartbeats, as in network.Connection
+		self.lastHeard = self.lastSent = self.arrived
+		self.speaks = False
+		self.answers = False
+		#set once the connection is to be closed as soon as everything queued has been sent
+		self.closing = False
+
+	# Sends straight away if the socket will take it, rather than waiting its turn in the event
+	# loop behind every spectator
+	@metrics.timed('send')
+	def sendMessage(self, payload):
+		metrics.count('sent')
+		self.outgoing += protocol.frame(payload)
+		self.lastSent = time.time()
+		if self.connected:
+			try:
+				sent = self.socket.send(self.outgoing)
+				self.outgoing = self.outgoing[sent:]
+			except socket.error:
+				#whatever went wrong, the event loop will find out for itself
+				pass
+
+	# Sends one last message, and closes the connection once it has gone
+	def sendLast(self, payload):
+		self.sendMessage(payload)
+		self.closing = True
+		if not self.outgoing:
+			self.close()
+
+	def writable(self):
+		return bool(self.outgoing)
+
+	def handle_write(self):
+		sent = self.send(self.outgoing)
+		self.outgoing = self.outgoing[sent:]
+		if self.closing and not self.outgoing:
+			self.close()
+
+	@metrics.timed('receive')
+	def handle_read(self):
+		data = self.recv(4096)
+		self.lastHeard = time.time()
+		for payload in self.frames.feed(data):
+			metrics.count('received')
+			kind = protocol.messageType(payload) if payload else None
+			if kind is not None:
+				self.speaks = True
+			if kind == protocol.PING:
+				self.sendMessage(protocol.encodePong(protocol.decodeStamp(payload)))
+			elif kind == protocol.PONG:
+				metrics.observe('rtt', self.lastHeard - protocol.decodeStamp(payload))
+				self.answers = True
+			elif payload:
+				self.server.route(self, payload)
+
+	# Pings a quiet connection, and drops one that has stopped answering
+	def heartbeat(self, now):
+		if self.answers and now - self.lastHeard > protocol.SILENCE:
+			log.warning("%s:%d stopped answering", *self.addr)
+			self.handle_close()
+		elif self.speaks and now - self.lastSent > protocol.HEARTBEAT:
+			self.sendMessage(protocol.encodePing(now))
+
+	def handle_close(self):
+		self.close()
+		self.server.disconnected(self)
+
+class GameServer(asyncore.dispatcher):
+	def __init__(self, port=protocol.PORT, archive='games.fowr', authoritative=False, backlog=1000, exportTo=None):
+		asyncore.dispatcher.__init__(self)
+		self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.set_reuse_addr()
+		self.bind(('', port))
+		self.listen(backlog)
+
+		self.gameIds = itertools.count(1)
+		self.games = {}
+		self.archive = gamerecord.ArchiveWriter(archive)
+		self.authoritative = authoritative
+		#new connections that might yet send RESUME, and a player waiting for an opponent
+		self.arriving = set()
+		self.waiting = None
+		self.spectators = broadcast.SpectatorServer(self.games, port + 1, backlog)
+		#when the log was last written out, and when the metrics were last looked at
+		self.flushed = self.reported = time.time()
+		#where the metrics go (see metrics.exportTarget), if anywhere
+		self.exportTo = exportTo
+
+	def handle_accept(self):
+		pair = self.accept()
+		if pair is None:
+			return
+		sock, addr = pair
+		log.info("Received connection from %s:%d", *addr)
+		self.arriving.add(PlayerConnection(self, sock, addr))
+
+	# Pairs a player with the one waiting, or leaves them waiting
+	def join(self, player):
+		if self.waiting:
+			game = Game(self.gameIds.next(), self.waiting, player, self.archive, self.authoritative)
+			self.games[game.id] = game
+			self.waiting = None
+			log.info("Game %d started (%d games running)", game.id, len(self.games))
+		else:
+			self.waiting = player
+
+	# Hands a received payload to the game it belongs to. A new connection's first message
+	# decides whether it is coming back to a game or needs an opponent.
+	def route(self, player, payload):
+		kind = protocol.messageType(payload)
+		if player in self.arriving:
+			self.arriving.discard(player)
+			if kind != protocol.RESUME:
+				self.join(player)
+		if kind == protocol.RESUME:
+			self.resume(player, *protocol.decodeResume(payload))
+		elif player.game and kind is None:
+			fr, to = protocol.decodeMove(payload)
+			player.game.receiveMove(player, fr, to)
+
+	# A player who lost their connection is back. If their RESUME took longer than ARRIVAL to
+	# arrive they have been paired up like any other connection, so first they are taken back
+	# out of that, and the player they were paired with is told and waits again.
+	def resume(self, player, gameId, key):
+		if player.game and player.game.board.history:
+			#they are already playing another game
+			return
+		if player is self.waiting:
+			self.waiting = None
+		elif player.game:
+			fresh = player.game
+			other = fresh.players[opponent[player.color]]
+			player.game = other.game = None
+			fresh.broadcast.end()
+			del self.games[fresh.id]
+			other.sendMessage(protocol.encodeRequeue())
+			self.join(other)
+		game = self.games.get(gameId)
+		color = game.seat(key) if game and not game.over else None
+		if color is None:
+			log.warning("%s:%d tried to resume game %d and was refused", player.addr[0], player.addr[1], gameId)
+			player.close()
+			return
+		game.resume(player, color)
+		log.info("Game %d: %s:%d resumed", game.id, player.addr[0], player.addr[1])
+
+	def disconnected(self, player):
+		self.arriving.discard(player)
+		if player is self.waiting:
+			self.waiting = None
+		elif player.game:
+			game = player.game
+			player.game = None
+			if game.disconnected(player):
+				self.ended(game)
+			else:
+				log.info("Game %d: holding a seat for %s:%d", game.id, player.addr[0], player.addr[1])
+
+	def ended(self, game):
+		del self.games[game.id]
+		log.info("Game %d ended (%d games running)", game.id, len(self.games))
+
+	# Runs between rounds of the event loop
+	@metrics.timed('tick')
+	def tick(self):
+		now = time.time()
+		for player in sorted((p for p in self.arriving if now - p.arrived > ARRIVAL), key=lambda p: p.arrived):
+			self.arriving.discard(player)
+			self.join(player)
+		for channel in asyncore.socket_map.values():
+			if isinstance(channel, PlayerConnection):
+				channel.heartbeat(now)
+		for game in [g for g in self.games.itervalues() if g.expired(now)]:
+			game.abandon()
+			self.ended(game)
+		if now - self.reported > metrics.REPORT:
+			self.reported = now
+			metrics.snapshot()
+			if self.exportTo:
+				metrics.export(self.exportTo)
+		if now - self.flushed > protocol.HEARTBEAT:
+			self.flushed = now
+			metrics.flushLog()
+
+	def run(self):
+		#poll() rather than select(), which can't handle more than a thousand-odd sockets
+		try:
+			while asyncore.socket_map:
+				asyncore.loop(timeout=protocol.HEARTBEAT / 2, use_poll=True, count=1)
+				self.tick()
+		finally:
+			self.archive.close()
+
+if __name__ == '__main__':
+	metrics.setupLogging()
+	#being killed should still mark the games in progress as unfinished in the archive
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	args = [a for a in sys.argv[1:] if not a.startswith('--')]
+	port = int(args[0]) if len(args) > 0 else protocol.PORT
+	archive = args[1] if len(args) > 1 else 'games.fowr'
+	GameServer(port, archive, '--authoritative' in sys.argv, exportTo=metrics.exportTarget(sys.argv)).run()
@@ -0,0 +1,111 @@
+# Incrementally maintained fog of war for one side.
+# Instead of asking every piece for its visible squares after each move, we remember what each
+# piece contributed and which squares it depends on, and only recompute the pieces a move could
+# have affected, then OR the contributions together to see which squares actually flipped.
+
+from bitboard import FULL, bit, square, indices, KNIGHT_ATTACKS, KING_ATTACKS, PAWN_SCOUT, rookAttacks, bishopAttacks, queenAttacks
+from chesscore import Pawn, Knight, Bishop, Rook, Queen, King, pieceCode
+
+# The squares whose contents can change what this piece sees: its rays up to and including the
+# first blocker for sliders, its whole pattern for leapers, and the squares in front of a pawn.
+def reachMask(piece, board):
+	i = piece.square[0] + 8*piece.square[1]
+	if isinstance(piece, Pawn):
+		return PAWN_SCOUT[piece.color][i]
+	if isinstance(piece, Knight):
+		return KNIGHT_ATTACKS[i]
+	if isinstance(piece, King):
+		return KING_ATTACKS[i]
+	occ = board.occupiedAll()
+	if isinstance(piece, Rook):
+		return rookAttacks(i, occ)
+	if isinstance(piece, Bishop):
+		return bishopAttacks(i, occ)
+	if isinstance(piece, Queen):
+		return queenAttacks(i, occ)
+	return FULL
+
+class VisibilityMap:
+	def __init__(self, board, color):
+		self.board = board
+		self.color = color
+		self.rebuild()
+
+	# Recomputes everything from nothing. Returns the visible squares as a bitboard.
+	def rebuild(self):
+		#what each piece currently sees, and the squares it depends on
+		self.contributions = {}
+		self.reaches = {}
+		for p in self.board.pieceList(self.color):
+			self.contributions[p] = p.visibleMask(self.board)
+			self.reaches[p] = reachMask(p, self.board)
+		self.visible = self.union()
+		return self.visible
+
+	# Everything our pieces see between them. Sixteen ORs are cheaper than keeping a count per
+	# square in step.
+	def union(self):
+		visible = 0
+		for mask in self.contributions.itervalues():
+			visible |= mask
+		return visible
+
+	# Brings the map up to date after the board has made the move fr -> to.
+	# Returns (revealed, hidden): bitboards of the squares that flipped.
+	def update(self, fr, to):
+		board = self.board
+		pieces = board.pieces
+		changed = bit(fr) | bit(to)
+		moved = False
+		for p, reach in self.reaches.items():
+			x, y = p.square
+			if pieces[x + 8*y] is not p:
+				#captured
+				del self.contributions[p]
+				del self.reaches[p]
+				moved = True
+			elif p.square == to:
+				self.contributions[p] = p.visibleMask(board)
+				self.reaches[p] = reachMask(p, board)
+				moved = True
+			elif reach & changed:
+				mask = p.visibleMask(board)
+				if mask != self.contributions[p]:
+					self.contributions[p] = mask
+					moved = True
+				#a leaper's or pawn's reach only depends on where it stands
+				if isinstance(p, (Rook, Bishop, Queen)):
+					self.reaches[p] = reachMask(p, board)
+		if not moved:
+			return 0, 0
+		before = self.visible
+		self.visible = self.union()
+		flipped = before ^ self.visible
+		return flipped & self.visible, flipped & before
+
+# What one side has been shown of the board, for a server that only tells players what they
+# can see. Each update returns just the squares that look different from before. A view with
+# no color sees the whole board, as a spectator might.
+class View:
+	def __init__(self, color=None):
+		self.color = color
+		#piece code on each square as last shown, or None for squares out of sight
+		self.shown = [None] * 64
+		self.visible = 0
+
+	# Returns [((x, y), code or None), ...] for every square that has changed since the last
+	# update: come into sight, gone out of sight, or changed hands in plain view
+	def update(self, board):
+		visible = FULL if self.color is None else board.visibleMask(self.color)
+		changes = []
+		for i in indices(visible | self.visible):
+			code = pieceCode(board.pieces[i]) if visible >> i & 1 else None
+			if code != self.shown[i]:
+				self.shown[i] = code
+				changes.append((square(i), code))
+		self.visible = visible
+		return changes
+
+	# Every square as last shown, for someone who has missed some updates
+	def snapshot(self):
+		return [(square(i), self.shown[i]) for i in xrange(64)]
@@ -0,0 +1,50 @@
+# Zobrist keys and a transposition table.
+# Every (side, kind of piece, square) gets a random 64-bit number, and a position's key is
+# the XOR of the numbers of the pieces on it. Moving a piece only takes two XORs, so
+# Board keeps its key up to date as it goes. Pawns can't move backwards, so a pawn has moved
+# exactly when it is off its starting rank. That means the pieces and the side to move
+# identify the position completely.
+
+import random
+
+_rand = random.Random(0x5EED)
+
+def _keys(count):
+	return [_rand.getrandbits(64) for i in xrange(count)]
+
+#PIECES[color][kind][square index]
+PIECES = [[_keys(64) for kind in xrange(6)] for color in xrange(2)]
+#mixed in when black is to move
+SIDE = [0, _rand.getrandbits(64)]
+
+#A position can hold more than one kind of result. Each kind is stored under the position's
+#key XORed with its own salt, so they don't collide with each other.
+MOVES = _rand.getrandbits(64)
+VISION = _keys(2)
+
+# A fixed-size table from keys to values. Each key has exactly one slot, picked by its low
+# bits, and a new entry replaces whatever was in its slot. Memory therefore stays bounded
+# however many positions go through it. The whole key is stored with the value, so a
+# different position landing in the same slot is a miss and never a wrong answer.
+class TranspositionTable:
+	def __init__(self, bits):
+		self.mask = (1 << bits) - 1
+		self.slots = [None] * (1 << bits)
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key):
+		#one read of the slot, so a put from another thread can't split the key from its value
+		entry = self.slots[key & self.mask]
+		if entry is not None and entry[0] == key:
+			self.hits += 1
+			return entry[1]
+		self.misses += 1
+		return None
+
+	def put(self, key, value):
+		self.slots[key & self.mask] = (key, value)
+
+	def clear(self):
+		self.slots = [None] * len(self.slots)
+		self.hits = self.misses = 0